@@ -0,0 +1,225 @@
+# backend/app/admission.py
+import os
+import time
+import math
+import threading
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+from dotenv import load_dotenv
+
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(os.path.dirname(__file__)), ".env"))
+
+# Per user (or per session when there is no user_id) token bucket
+USER_RATE_PER_MIN = float(os.getenv("USER_RATE_PER_MIN", "30"))
+USER_BURST = float(os.getenv("USER_BURST", "10"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "50000"))
+
+# Global upstream concurrency: callers beyond MAX_CONCURRENCY wait in a queue of
+# at most MAX_QUEUE entries; anything beyond that is rejected immediately.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+EMBED_MAX_CONCURRENCY = int(os.getenv("EMBED_MAX_CONCURRENCY", "8"))
+EMBED_MAX_QUEUE = int(os.getenv("EMBED_MAX_QUEUE", "32"))
+# Longest a caller will sit in the queue, even if its request deadline allows more.
+QUEUE_TIMEOUT_SECONDS = float(os.getenv("QUEUE_TIMEOUT_SECONDS", "10"))
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "30"))
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed. main.py turns it into a 429 with Retry-After."""
+
+    status_code = 429
+
+    def __init__(self, reason: str, retry_after: float = 1.0):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(AdmissionRejected):
+    """The request ran out of its deadline budget while waiting for an upstream slot."""
+
+    status_code = 503
+
+
+# ---------------------
+# Request deadlines
+# ---------------------
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+def start_deadline(seconds: float = REQUEST_DEADLINE_SECONDS):
+    """Set the deadline for the current request/task. Returns a token for end_deadline()."""
+    return _deadline.set(time.monotonic() + seconds)
+
+
+def end_deadline(token):
+    _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left in the current request's budget, or None when no deadline is set."""
+    d = _deadline.get()
+    if d is None:
+        return None
+    return d - time.monotonic()
+
+
+# ---------------------
+# Token buckets
+# ---------------------
+class TokenBucket:
+    def __init__(self, rate_per_sec: float, capacity: float):
+        self.rate = rate_per_sec
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, n: float = 1.0) -> float:
+        """Take n tokens. Returns 0 on success, otherwise seconds until n tokens are available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= n:
+            self.tokens -= n
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (n - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Keyed token buckets; least recently seen keys are dropped beyond max_keys."""
+
+    def __init__(self, rate_per_min: float, burst: float, max_keys: int = 50000):
+        self.rate = rate_per_min / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+
+    def check(self, key: str):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.burst)
+                self._buckets[key] = bucket
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            wait = bucket.take()
+            if wait:
+                self.rejected += 1
+            else:
+                self.allowed += 1
+        if wait:
+            raise AdmissionRejected("rate limit exceeded", retry_after=wait)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"allowed": self.allowed, "rejected": self.rejected, "tracked_keys": len(self._buckets)}
+
+
+# ---------------------
+# Upstream concurrency
+# ---------------------
+class ConcurrencyLimiter:
+    """
+    Counting semaphore with a bounded wait queue. Used around blocking upstream calls,
+    so it is thread-based (works for request handlers and background/batch workers alike).
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, queue_timeout: float = QUEUE_TIMEOUT_SECONDS):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.peak_waiting = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_deadline = 0
+        # EWMA of how long a slot is held; used to compute Retry-After
+        self._avg_hold = 1.0
+
+    def _retry_after(self) -> float:
+        per_slot = self._avg_hold * (self.waiting + 1) / max(self.max_concurrency, 1)
+        return max(1.0, math.ceil(per_slot))
+
+    def acquire(self):
+        with self._cond:
+            if self.active < self.max_concurrency and self.waiting == 0:
+                self.active += 1
+                self.admitted += 1
+                return
+            if self.waiting >= self.max_queue:
+                self.rejected_queue_full += 1
+                raise AdmissionRejected(f"{self.name} queue full", retry_after=self._retry_after())
+
+            budget = self.queue_timeout
+            left = remaining()
+            if left is not None:
+                budget = min(budget, left)
+            end = time.monotonic() + budget
+
+            self.waiting += 1
+            self.peak_waiting = max(self.peak_waiting, self.waiting)
+            try:
+                while self.active >= self.max_concurrency:
+                    timeout = end - time.monotonic()
+                    if timeout <= 0 or not self._cond.wait(timeout):
+                        if self.active < self.max_concurrency:
+                            break
+                        self.rejected_deadline += 1
+                        raise DeadlineExceeded(f"{self.name} wait exceeded deadline", retry_after=self._retry_after())
+            finally:
+                self.waiting -= 1
+            self.active += 1
+            self.admitted += 1
+
+    def release(self, held_for: float):
+        with self._cond:
+            self.active -= 1
+            self._avg_hold = 0.8 * self._avg_hold + 0.2 * held_for
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "queue_depth": self.waiting,
+            "peak_queue_depth": self.peak_waiting,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_deadline": self.rejected_deadline,
+            "avg_hold_seconds": round(self._avg_hold, 3),
+        }
+
+
+rate_limiter = RateLimiter(USER_RATE_PER_MIN, USER_BURST, RATE_LIMIT_MAX_KEYS)
+llm_limiter = ConcurrencyLimiter("llm", LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE)
+embed_limiter = ConcurrencyLimiter("embeddings", EMBED_MAX_CONCURRENCY, EMBED_MAX_QUEUE)
+
+
+def metrics() -> Dict[str, Any]:
+    return {
+        "rate_limit": rate_limiter.metrics(),
+        "llm": llm_limiter.metrics(),
+        "embeddings": embed_limiter.metrics(),
+    }
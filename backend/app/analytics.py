@@ -0,0 +1,103 @@
+# backend/app/analytics.py
+"""
+Escalation events + incrementally maintained hourly rollups.
+
+Everything here takes an open cursor so it runs inside the caller's transaction
+(faq.record_turn writes the assistant message, its escalation event and the rollup
+increments atomically). The stats endpoint only ever reads hourly_stats.
+"""
+from typing import Dict, Any, List, Optional
+
+ROLLUP_COUNTERS = (
+    "messages",        # user messages answered
+    "escalations",
+    "faq_lookups",
+    "faq_hits",        # lookups that returned at least one FAQ
+    "llm_calls",
+    "llm_latency_ms",
+    "tokens",
+)
+
+
+def create_tables(cur):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS escalation_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT,
+            message_id INTEGER,
+            rule TEXT NOT NULL, -- e.g. 'keyword:refund' or 'model'
+            topic TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_escalation_events_created_at ON escalation_events (created_at)")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS hourly_stats (
+            hour TEXT NOT NULL, -- UTC, 'YYYY-MM-DDTHH:00'
+            topic TEXT NOT NULL DEFAULT '',
+            messages INTEGER NOT NULL DEFAULT 0,
+            escalations INTEGER NOT NULL DEFAULT 0,
+            faq_lookups INTEGER NOT NULL DEFAULT 0,
+            faq_hits INTEGER NOT NULL DEFAULT 0,
+            llm_calls INTEGER NOT NULL DEFAULT 0,
+            llm_latency_ms REAL NOT NULL DEFAULT 0,
+            tokens INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (hour, topic)
+        );
+        """
+    )
+
+
+def record_escalation(cur, session_id: str, message_id: Optional[int], rule: str, topic: str = ""):
+    cur.execute(
+        "INSERT INTO escalation_events (session_id, message_id, rule, topic) VALUES (?, ?, ?, ?)",
+        (session_id, message_id, rule, topic),
+    )
+
+
+def bump_hourly(cur, topic: str = "", **counters):
+    """Add `counters` (names from ROLLUP_COUNTERS) to the current UTC hour's row for `topic`."""
+    unknown = set(counters) - set(ROLLUP_COUNTERS)
+    if unknown:
+        raise ValueError(f"Unknown rollup counters: {sorted(unknown)}")
+    values = [counters.get(c, 0) or 0 for c in ROLLUP_COUNTERS]
+    cols = ", ".join(ROLLUP_COUNTERS)
+    updates = ", ".join(f"{c} = {c} + excluded.{c}" for c in ROLLUP_COUNTERS)
+    cur.execute(
+        f"""
+        INSERT INTO hourly_stats (hour, topic, {cols})
+        VALUES (strftime('%Y-%m-%dT%H:00', 'now'), ?, {", ".join("?" * len(ROLLUP_COUNTERS))})
+        ON CONFLICT(hour, topic) DO UPDATE SET {updates}
+        """,
+        [topic or ""] + values,
+    )
+
+
+def _with_rates(row: Dict[str, Any]) -> Dict[str, Any]:
+    row["escalation_rate"] = round(row["escalations"] / row["messages"], 4) if row["messages"] else None
+    row["faq_hit_rate"] = round(row["faq_hits"] / row["faq_lookups"], 4) if row["faq_lookups"] else None
+    row["avg_llm_latency_ms"] = round(row["llm_latency_ms"] / row["llm_calls"], 1) if row["llm_calls"] else None
+    row["llm_latency_ms"] = round(row["llm_latency_ms"], 1)
+    return row
+
+
+def read_stats(cur, hours: int = 24, group_by: str = "hour", topic: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Aggregate hourly_stats over the last `hours` hours, grouped by "hour", "topic" or
+    "hour_topic". Never touches the message tables.
+    """
+    keys = {"hour": ["hour"], "topic": ["topic"], "hour_topic": ["hour", "topic"]}.get(group_by)
+    if keys is None:
+        raise ValueError("group_by must be one of: hour, topic, hour_topic")
+    sums = ", ".join(f"SUM({c}) AS {c}" for c in ROLLUP_COUNTERS)
+    where = "hour >= strftime('%Y-%m-%dT%H:00', 'now', ?)"
+    params: list = [f"-{int(hours) - 1} hours"]
+    if topic is not None:
+        where += " AND topic = ?"
+        params.append(topic)
+    group = ", ".join(keys)
+    cur.execute(f"SELECT {group}, {sums} FROM hourly_stats WHERE {where} GROUP BY {group} ORDER BY {group}", params)
+    return [_with_rates(dict(r)) for r in cur.fetchall()]
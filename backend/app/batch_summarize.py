@@ -0,0 +1,250 @@
+# backend/app/batch_summarize.py
+"""
+Offline summarization of finished sessions.
+
+    python -m app.batch_summarize --concurrency 4 --idle-minutes 30
+
+Picks sessions with no summary (or new messages since the last one), packs short
+transcripts several-per-request, runs packs on a bounded thread pool and stores
+results in session_summaries. Progress is checkpointed to a JSON file after every
+pack; re-running after a crash resumes the same snapshot of sessions.
+"""
+import os
+import json
+import time
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, CancelledError
+from typing import List, Dict, Any
+
+from . import faq, admission
+from .admission import AdmissionRejected
+from .resilience import UpstreamUnavailable
+from .llm_client import summarize_session, summarize_sessions_batch
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_WINDOW = int(os.getenv("CONTEXT_WINDOW", "8"))
+# same history length the /sessions/{id}/summarize endpoint uses
+TRANSCRIPT_LIMIT = CONTEXT_WINDOW * 10
+PACK_DEADLINE_SECONDS = float(os.getenv("BATCH_PACK_DEADLINE_SECONDS", "120"))
+
+
+def _conversation_text(messages: List[Dict[str, Any]]) -> str:
+    return "\n".join(f"{(m.get('role') or '').upper()}: {m.get('content') or ''}" for m in messages)
+
+
+def pack_sessions(items: List[Dict[str, Any]], max_chars: int, max_per_pack: int) -> List[List[Dict[str, Any]]]:
+    """
+    Greedy packing by transcript size: short transcripts share a request up to
+    `max_chars` total / `max_per_pack` sessions; long ones go alone.
+    """
+    packs, current, size = [], [], 0
+    for item in sorted(items, key=lambda i: len(i["text"])):
+        n = len(item["text"])
+        if current and (size + n > max_chars or len(current) >= max_per_pack):
+            packs.append(current)
+            current, size = [], 0
+        current.append(item)
+        size += n
+    if current:
+        packs.append(current)
+    return packs
+
+
+class Checkpoint:
+    """JSON file holding the run's session snapshot plus what is done/failed. Written atomically."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.state: Dict[str, Any] = {}
+
+    def load(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, "r", encoding="utf-8") as f:
+            self.state = json.load(f)
+        return True
+
+    def start(self, candidates: List[Dict[str, Any]]):
+        self.state = {
+            "started_at": time.time(),
+            "elapsed_seconds": 0.0,
+            "candidates": candidates,
+            "done": [],
+            "failed": {},
+        }
+        self.save()
+
+    def pending(self) -> List[Dict[str, Any]]:
+        finished = set(self.state["done"]) | set(self.state["failed"])
+        return [c for c in self.state["candidates"] if c["session_id"] not in finished]
+
+    def mark(self, done: List[str], failed: Dict[str, str], elapsed: float):
+        with self._lock:
+            self.state["done"].extend(done)
+            self.state["failed"].update(failed)
+            self.state["elapsed_seconds"] = elapsed
+            self.save()
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class PackStopped(Exception):
+    """The provider went away (or shed us) part-way through a pack."""
+
+    def __init__(self, cause: Exception, done: List[str], failed: Dict[str, str]):
+        super().__init__(str(cause))
+        self.cause = cause
+        self.done = done  # sessions of this pack already saved before it stopped
+        self.failed = failed
+
+
+def _summarize_pack(pack: List[Dict[str, Any]]) -> Dict[str, str]:
+    """
+    Summarize one pack and persist results. Returns session_id -> error for failures.
+    Raises PackStopped (carrying what was already saved) when the provider is unavailable.
+    """
+    token = admission.start_deadline(PACK_DEADLINE_SECONDS)
+    done: List[str] = []
+    failed: Dict[str, str] = {}
+    try:
+        results = {}
+        try:
+            results = summarize_sessions_batch({i["session_id"]: i["text"] for i in pack})
+        except (AdmissionRejected, UpstreamUnavailable):
+            raise
+        except Exception as e:
+            logger.warning("packed summary of %d sessions failed, retrying individually: %s", len(pack), e)
+
+        for item in pack:
+            sid = item["session_id"]
+            result = results.get(sid)
+            if result is None:
+                try:
+                    result = summarize_session(sid, item["text"])
+                except (AdmissionRejected, UpstreamUnavailable):
+                    raise
+                except Exception as e:
+                    failed[sid] = str(e)
+                    continue
+            faq.save_summary(sid, result.get("summary", ""), result.get("next_action"), item["last_message_id"])
+            done.append(sid)
+        return failed
+    except (AdmissionRejected, UpstreamUnavailable) as e:
+        raise PackStopped(e, done, failed) from e
+    finally:
+        admission.end_deadline(token)
+
+
+def run(
+    concurrency: int = 4,
+    idle_minutes: int = 30,
+    limit: int = 0,
+    pack_chars: int = 6000,
+    pack_max: int = 5,
+    checkpoint_path: str = "./batch_summarize.checkpoint.json",
+    fresh: bool = False,
+) -> Dict[str, Any]:
+    checkpoint = Checkpoint(checkpoint_path)
+    if not fresh and checkpoint.load():
+        logger.info("Resuming run from %s", checkpoint_path)
+    else:
+        candidates = faq.find_sessions_to_summarize(idle_minutes=idle_minutes, limit=limit or None)
+        checkpoint.start(candidates)
+
+    pending = checkpoint.pending()
+    total = len(checkpoint.state["candidates"])
+    logger.info("%d sessions in run, %d left to summarize", total, len(pending))
+
+    items = []
+    for c in pending:
+        messages = faq.get_transcript(c["session_id"], up_to_id=c["last_message_id"], limit=TRANSCRIPT_LIMIT)
+        if messages:
+            items.append({**c, "text": _conversation_text(messages)})
+    packs = pack_sessions(items, pack_chars, pack_max)
+
+    prior_elapsed = checkpoint.state.get("elapsed_seconds", 0.0)
+    started = time.monotonic()
+    processed = 0
+    stopped_early = False
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {pool.submit(_summarize_pack, p): p for p in packs}
+        for fut in as_completed(futures):
+            pack = futures[fut]
+            try:
+                failed = fut.result()
+                done = [i["session_id"] for i in pack if i["session_id"] not in failed]
+            except CancelledError:
+                continue
+            except PackStopped as e:
+                # provider unhealthy or we're being shed: keep what this pack already saved,
+                # leave the rest (and every pack not yet started) pending for the next run
+                if not stopped_early:
+                    logger.warning("stopping: %s", e)
+                stopped_early = True
+                for f in futures:
+                    f.cancel()
+                done, failed = e.done, e.failed
+            elapsed = prior_elapsed + time.monotonic() - started
+            checkpoint.mark(done, failed, elapsed)
+            processed += len(done) + len(failed)
+            logger.info(
+                "%d/%d sessions (%.1f sessions/min)",
+                len(checkpoint.state["done"]) + len(checkpoint.state["failed"]),
+                total,
+                60.0 * processed / max(time.monotonic() - started, 1e-6),
+            )
+
+    elapsed = prior_elapsed + time.monotonic() - started
+    done_count = len(checkpoint.state["done"])
+    report = {
+        "sessions": total,
+        "summarized": done_count,
+        "failed": len(checkpoint.state["failed"]),
+        "remaining": len(checkpoint.pending()),
+        "requests": len(packs),
+        "elapsed_seconds": round(elapsed, 1),
+        "sessions_per_minute": round(60.0 * done_count / elapsed, 1) if elapsed > 0 else None,
+    }
+    if not stopped_early and report["remaining"] == 0:
+        checkpoint.clear()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize finished sessions in bulk.")
+    parser.add_argument("--concurrency", type=int, default=4, help="packs summarized in parallel")
+    parser.add_argument("--idle-minutes", type=int, default=30, help="sessions idle this long count as finished")
+    parser.add_argument("--limit", type=int, default=0, help="max sessions per run (0 = all)")
+    parser.add_argument("--pack-chars", type=int, default=6000, help="max transcript characters per request")
+    parser.add_argument("--pack-max", type=int, default=5, help="max sessions per request")
+    parser.add_argument("--checkpoint", default="./batch_summarize.checkpoint.json")
+    parser.add_argument("--fresh", action="store_true", help="ignore an existing checkpoint and start over")
+    args = parser.parse_args()
+
+    report = run(
+        concurrency=args.concurrency,
+        idle_minutes=args.idle_minutes,
+        limit=args.limit,
+        pack_chars=args.pack_chars,
+        pack_max=args.pack_max,
+        checkpoint_path=args.checkpoint,
+        fresh=args.fresh,
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
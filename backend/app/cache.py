@@ -0,0 +1,477 @@
+# backend/app/cache.py
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import hashlib
+import logging
+import argparse
+import threading
+import socketserver
+from array import array
+from collections import OrderedDict
+from typing import Any, Optional
+from urllib.parse import urlparse
+from dotenv import load_dotenv
+
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(os.path.dirname(__file__)), ".env"))
+
+logger = logging.getLogger(__name__)
+
+# Backend selection: "memory" (per-process LRU), "sqlite" (shared file on this machine)
+# or "redis" (anything speaking the Redis protocol). "none" disables caching.
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+CACHE_URL = os.getenv("CACHE_URL", "")
+CACHE_MAX_ITEMS = int(os.getenv("CACHE_MAX_ITEMS", "10000"))
+# Bump to invalidate every entry written by an older release (prompt/model/format changes).
+CACHE_KEY_VERSION = os.getenv("CACHE_KEY_VERSION", "1")
+
+
+# ---------------------
+# Keys + serialization
+# ---------------------
+def make_key(namespace: str, *parts: Any) -> str:
+    """
+    Build a versioned cache key: "<version>:<namespace>:<sha256 of parts>".
+    Parts are JSON-encoded so the same logical input always hashes the same.
+    """
+    raw = json.dumps(parts, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    digest = hashlib.sha256(raw.encode("utf-8")).hexdigest()
+    return f"v{CACHE_KEY_VERSION}:{namespace}:{digest}"
+
+
+# One tag byte followed by the payload:
+#   b"J" -> UTF-8 JSON (lossless; what set() always writes)
+#   b"V" -> float32 little-endian vector, only written by set_vector() (4 bytes per
+#           dimension instead of ~20 as JSON text, at float32 precision)
+_TAG_VECTOR = b"V"
+_TAG_JSON = b"J"
+
+
+def dumps(value: Any) -> bytes:
+    return _TAG_JSON + json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def dumps_vector(vector) -> bytes:
+    arr = array("f", vector)
+    if arr.itemsize != 4:
+        raise RuntimeError("float32 array type is not 4 bytes on this platform")
+    if sys.byteorder != "little":
+        arr.byteswap()
+    return _TAG_VECTOR + arr.tobytes()
+
+
+def loads(data: bytes) -> Any:
+    tag, payload = data[:1], data[1:]
+    if tag == _TAG_VECTOR:
+        arr = array("f")
+        arr.frombytes(payload)
+        if sys.byteorder != "little":
+            arr.byteswap()
+        return arr.tolist()
+    if tag == _TAG_JSON:
+        return json.loads(payload.decode("utf-8"))
+    raise ValueError(f"Unknown cache payload tag: {tag!r}")
+
+
+# ---------------------
+# Backends
+# ---------------------
+class BaseCache:
+    """
+    Minimal byte-oriented cache interface. Values passed to get/set are plain Python
+    objects; backends only ever see the bytes produced by dumps() / dumps_vector().
+    A ttl of None (or 0) means "no expiry".
+    """
+
+    def get_raw(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set_raw(self, key: str, data: bytes, ttl: Optional[float] = None):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def get(self, key: str) -> Any:
+        try:
+            data = self.get_raw(key)
+        except Exception as e:
+            # cache is best-effort: a broken backend must never break a request
+            logger.warning("cache get failed for %s: %s", key, e)
+            return None
+        if data is None:
+            return None
+        try:
+            return loads(data)
+        except Exception as e:
+            logger.warning("cache decode failed for %s: %s", key, e)
+            return None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        try:
+            self.set_raw(key, dumps(value), ttl)
+        except Exception as e:
+            logger.warning("cache set failed for %s: %s", key, e)
+
+    def set_vector(self, key: str, vector, ttl: Optional[float] = None):
+        """Store a float vector compactly as float32 (values come back rounded to float32)."""
+        try:
+            self.set_raw(key, dumps_vector(vector), ttl)
+        except Exception as e:
+            logger.warning("cache set failed for %s: %s", key, e)
+
+    def get_vector(self, key: str) -> Optional[list]:
+        return self.get(key)
+
+    def invalidate(self, key: str):
+        try:
+            self.delete(key)
+        except Exception as e:
+            logger.warning("cache delete failed for %s: %s", key, e)
+
+
+class NullCache(BaseCache):
+    def get_raw(self, key):
+        return None
+
+    def set_raw(self, key, data, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+
+class LRUCache(BaseCache):
+    """In-process LRU with optional per-entry TTL. Not shared between workers."""
+
+    def __init__(self, max_items: int = 10000):
+        self.max_items = max_items
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_raw(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            data, expires_at = item
+            if expires_at and expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return data
+
+    def set_raw(self, key, data, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (data, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class SQLiteCache(BaseCache):
+    """
+    File-backed cache shared by every worker on the same machine.
+    Uses WAL mode so readers don't block the writer; eviction drops the least recently
+    written entries and only runs every `prune_every` writes.
+    """
+
+    def __init__(self, path: str, max_items: int = 10000, prune_every: int = 500):
+        self.path = path
+        self.max_items = max_items
+        self.prune_every = prune_every
+        self._writes = 0
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                expires_at REAL,
+                written_at REAL NOT NULL
+            );
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_written_at ON cache (written_at)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_raw(self, key):
+        conn = self._conn()
+        now = time.time()
+        row = conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at and expires_at < now:
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            conn.commit()
+            return None
+        return bytes(value)
+
+    def set_raw(self, key, data, ttl=None):
+        conn = self._conn()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at, written_at) VALUES (?, ?, ?, ?)",
+            (key, sqlite3.Binary(data), now + ttl if ttl else None, now),
+        )
+        conn.commit()
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            self._prune(conn, now)
+
+    def delete(self, key):
+        conn = self._conn()
+        conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+        conn.commit()
+
+    def _prune(self, conn: sqlite3.Connection, now: float):
+        conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at < ?", (now,))
+        conn.execute(
+            "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY written_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_items,),
+        )
+        conn.commit()
+
+
+class RedisCache(BaseCache):
+    """
+    Tiny Redis-protocol (RESP2) client covering GET / SET PX / DEL.
+    Avoids a hard dependency on redis-py and works against any compatible server
+    (Redis, Valkey, KeyDB, or the RespStub below).
+    """
+
+    def __init__(self, url: str = "redis://127.0.0.1:6379/0", timeout: float = 0.5):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int((parsed.path or "/0").lstrip("/") or 0)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    # --- connection + protocol ---
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._local.sock = sock
+        self._local.reader = sock.makefile("rb")
+        if self.password:
+            self._command("AUTH", self.password)
+        if self.db:
+            self._command("SELECT", str(self.db))
+
+    def _close(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            try:
+                sock.close()
+            except Exception:
+                pass
+        self._local.sock = None
+        self._local.reader = None
+
+    def _send(self, *args):
+        out = [b"*%d\r\n" % len(args)]
+        for a in args:
+            b = a if isinstance(a, bytes) else str(a).encode("utf-8")
+            out.append(b"$%d\r\n%s\r\n" % (len(b), b))
+        self._local.sock.sendall(b"".join(out))
+
+    def _read_reply(self):
+        line = self._local.reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest
+        if kind == b"-":
+            raise RuntimeError(f"Redis error: {rest.decode('utf-8', 'replace')}")
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            n = int(rest)
+            if n < 0:
+                return None
+            data = self._local.reader.read(n + 2)
+            return data[:-2]
+        if kind == b"*":
+            n = int(rest)
+            if n < 0:
+                return None
+            return [self._read_reply() for _ in range(n)]
+        raise RuntimeError(f"Unexpected Redis reply: {line!r}")
+
+    def _command(self, *args):
+        self._send(*args)
+        return self._read_reply()
+
+    def execute(self, *args):
+        # one reconnect attempt per call; the socket is per-thread
+        for attempt in range(2):
+            if getattr(self._local, "sock", None) is None:
+                self._connect()
+            try:
+                return self._command(*args)
+            except (ConnectionError, OSError):
+                self._close()
+                if attempt:
+                    raise
+
+    # --- cache interface ---
+    def get_raw(self, key):
+        return self.execute("GET", key)
+
+    def set_raw(self, key, data, ttl=None):
+        if ttl:
+            self.execute("SET", key, data, "PX", str(int(ttl * 1000)))
+        else:
+            self.execute("SET", key, data)
+
+    def delete(self, key):
+        self.execute("DEL", key)
+
+
+# ---------------------
+# Local stand-in (testing)
+# ---------------------
+class RespStub(socketserver.ThreadingTCPServer):
+    """
+    In-memory server speaking enough RESP2 for RedisCache: PING, AUTH, SELECT,
+    GET, SET (with PX / EX) and DEL. drop_connections() closes every client
+    socket so the reconnect path can be exercised.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port: int = 0, host: str = "127.0.0.1"):
+        self.data = {}  # key -> (value bytes, expires_at or None)
+        self.commands = []  # command names received, for inspection
+        self.clients = set()
+        self.lock = threading.Lock()
+        super().__init__((host, port), _RespHandler)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"redis://{host}:{port}/0"
+
+    def start(self) -> "RespStub":
+        threading.Thread(target=self.serve_forever, name="resp-stub", daemon=True).start()
+        return self
+
+    def drop_connections(self):
+        with self.lock:
+            clients, self.clients = list(self.clients), set()
+        for sock in clients:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+                sock.close()
+            except OSError:
+                pass
+
+    def execute(self, args):
+        name = args[0].decode("utf-8").upper()
+        with self.lock:
+            self.commands.append(name)
+            now = time.time()
+            if name in ("PING", "AUTH", "SELECT"):
+                return b"+PONG\r\n" if name == "PING" else b"+OK\r\n"
+            if name == "GET":
+                value, expires_at = self.data.get(args[1], (None, None))
+                if value is None or (expires_at and expires_at < now):
+                    self.data.pop(args[1], None)
+                    return b"$-1\r\n"
+                return b"$%d\r\n%s\r\n" % (len(value), value)
+            if name == "SET":
+                expires_at = None
+                opts = [a.decode("utf-8").upper() for a in args[3::2]]
+                for opt, amount in zip(opts, args[4::2]):
+                    if opt == "PX":
+                        expires_at = now + int(amount) / 1000.0
+                    elif opt == "EX":
+                        expires_at = now + int(amount)
+                self.data[args[1]] = (args[2], expires_at)
+                return b"+OK\r\n"
+            if name == "DEL":
+                removed = sum(1 for k in args[1:] if self.data.pop(k, None) is not None)
+                return b":%d\r\n" % removed
+        return b"-ERR unknown command '%s'\r\n" % name.encode("utf-8")
+
+
+class _RespHandler(socketserver.StreamRequestHandler):
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if line[:1] != b"*":
+            return line.split()  # inline command (e.g. typed into nc)
+        args = []
+        for _ in range(int(line[1:-2])):
+            n = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(n + 2)[:-2])
+        return args
+
+    def handle(self):
+        with self.server.lock:
+            self.server.clients.add(self.connection)
+        try:
+            while True:
+                args = self._read_command()
+                if not args:
+                    return
+                self.wfile.write(self.server.execute(args))
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self.server.lock:
+                self.server.clients.discard(self.connection)
+
+
+# ---------------------
+# Shared instance
+# ---------------------
+def create_cache(backend: str = CACHE_BACKEND, url: str = CACHE_URL) -> BaseCache:
+    if backend == "none":
+        return NullCache()
+    if backend == "memory":
+        return LRUCache(CACHE_MAX_ITEMS)
+    if backend == "sqlite":
+        return SQLiteCache(url or "./cache.sqlite3", CACHE_MAX_ITEMS)
+    if backend == "redis":
+        return RedisCache(url or "redis://127.0.0.1:6379/0")
+    raise ValueError(f"Unknown CACHE_BACKEND: {backend}")
+
+
+cache = create_cache()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local RESP stand-in for CACHE_BACKEND=redis.")
+    parser.add_argument("--stub", type=int, default=6399, metavar="PORT")
+    args = parser.parse_args()
+    server = RespStub(args.stub)
+    print(f"RESP stand-in on {server.url} (CACHE_BACKEND=redis CACHE_URL={server.url})")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
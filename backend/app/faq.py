@@ -1,7 +1,10 @@
 # backend/faq.py
 import os
+import re
 import json
+import logging
 import sqlite3
+import threading
 from typing import List, Dict, Any, Optional
 import numpy as np
 from dotenv import load_dotenv
@@ -10,6 +13,12 @@ from dotenv import load_dotenv
 # path: backend/app/llm_client.py -> importable as app.llm_client if backend is run as top-level
 from .llm_client import client as openai_client
   # <- re-uses your existing OpenAI client
+from .cache import cache, make_key
+from .admission import embed_limiter
+from .resilience import UpstreamUnavailable, embed_policy
+from .faq_index import FaqIndex, load_vectors, row_vector, to_blob
+from .profiling import stage
+from . import analytics
 
 load_dotenv()
 
@@ -20,6 +29,20 @@ else:
     DB_FILE = "./ai-cs-bot.db"
 
 EMBED_MODEL = os.getenv("EMBED_MODEL", "text-embedding-3-small")
+# Embeddings are deterministic per (model, text) so they can live for a long time.
+EMBED_CACHE_TTL = float(os.getenv("EMBED_CACHE_TTL", str(7 * 24 * 3600)))
+HISTORY_CACHE_TTL = float(os.getenv("HISTORY_CACHE_TTL", "300"))
+# Most recent messages kept in a session's cached history window
+HISTORY_CACHE_WINDOW = int(os.getenv("HISTORY_CACHE_WINDOW", "100"))
+KEYWORD_MIN_SCORE = float(os.getenv("KEYWORD_MIN_SCORE", "0.3"))
+# Vector index: exact | int8 | truncate (see faq_index.py)
+FAQ_INDEX_MODE = os.getenv("FAQ_INDEX_MODE", "exact").lower()
+FAQ_INDEX_DIMS = int(os.getenv("FAQ_INDEX_DIMS", "256"))
+FAQ_RESCORE_CANDIDATES = int(os.getenv("FAQ_RESCORE_CANDIDATES", "32"))
+# Session metadata keys that restrict FAQ search to the session's own slice
+FAQ_FILTER_KEYS = [k.strip() for k in os.getenv("FAQ_FILTER_KEYS", "tenant,product").split(",") if k.strip()]
+
+logger = logging.getLogger(__name__)
 
 
 # ---------------------
@@ -66,10 +89,63 @@ def init_tables():
         );
         """
     )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS session_summaries (
+            session_id TEXT PRIMARY KEY,
+            summary TEXT,
+            next_action TEXT,
+            last_message_id INTEGER, -- summary covers messages up to this id
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_messages_session_id ON messages (session_id)")
+    # older DBs were created before messages had an escalated flag
+    cur.execute("PRAGMA table_info(messages);")
+    if "escalated" not in [row[1] for row in cur.fetchall()]:
+        cur.execute("ALTER TABLE messages ADD COLUMN escalated INTEGER NOT NULL DEFAULT 0;")
+    # float32 copy of the embedding for rescoring (the JSON column is kept for other readers)
+    cur.execute("PRAGMA table_info(faqs);")
+    if "embedding_f32" not in [row[1] for row in cur.fetchall()]:
+        cur.execute("ALTER TABLE faqs ADD COLUMN embedding_f32 BLOB;")
+    _backfill_vector_blobs(cur)
+    analytics.create_tables(cur)
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS escalation_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT NOT NULL UNIQUE,
+            session_id TEXT,
+            message_id INTEGER,
+            rule TEXT,
+            status TEXT NOT NULL DEFAULT 'pending', -- pending | delivering | delivered | failed
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0, -- unix time
+            lease_until REAL, -- set while a dispatcher owns the row
+            last_error TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            delivered_at DATETIME
+        );
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_escalation_outbox_status ON escalation_outbox (status, next_attempt_at)")
     conn.commit()
     conn.close()
 
 
+def _backfill_vector_blobs(cur):
+    """Fill embedding_f32 for rows written before the column existed (or by other tools)."""
+    cur.execute("SELECT id, embedding FROM faqs WHERE embedding_f32 IS NULL")
+    rows = cur.fetchall()
+    if rows:
+        cur.executemany(
+            "UPDATE faqs SET embedding_f32 = ? WHERE id = ?",
+            [(to_blob(json.loads(r["embedding"])), r["id"]) for r in rows],
+        )
+        logger.info("Backfilled float32 embeddings for %d FAQs", len(rows))
+
+
 init_tables()
 
 
@@ -80,12 +156,25 @@ def embed_texts(texts: List[str]) -> List[List[float]]:
     """
     Use the shared openai_client (from app.llm_client) to compute embeddings.
     Returns a list of embedding vectors (lists of floats) matching texts order.
+    Cached per text; only the misses are sent to the API (in one batch).
     """
     if not texts:
         return []
-    resp = openai_client.embeddings.create(model=EMBED_MODEL, input=texts)
-    # resp.data -> list of objects with .embedding
-    embeddings = [item.embedding for item in resp.data]
+    keys = [make_key("embed", EMBED_MODEL, t) for t in texts]
+    embeddings: List[Optional[List[float]]] = [cache.get_vector(k) for k in keys]
+    missing = [i for i, e in enumerate(embeddings) if e is None]
+    if missing:
+        batch = [texts[i] for i in missing]
+
+        def _create(timeout: float):
+            with embed_limiter.slot():
+                return openai_client.embeddings.create(model=EMBED_MODEL, input=batch, timeout=timeout)
+
+        resp = embed_policy.call(_create)
+        # resp.data -> list of objects with .embedding
+        for i, item in zip(missing, resp.data):
+            embeddings[i] = item.embedding
+            cache.set_vector(keys[i], item.embedding, ttl=EMBED_CACHE_TTL)
     return embeddings
 
 
@@ -103,42 +192,94 @@ def upsert_faqs(faq_items: List[Dict[str, Any]]):
     cur = conn.cursor()
     for item, emb in zip(faq_items, embeddings):
         cur.execute(
-            "INSERT INTO faqs (question, answer, embedding, metadata) VALUES (?, ?, ?, ?)",
-            (item["question"], item.get("answer", ""), json.dumps(emb), json.dumps(item.get("metadata", {}))),
+            "INSERT INTO faqs (question, answer, embedding, embedding_f32, metadata) VALUES (?, ?, ?, ?, ?)",
+            (item["question"], item.get("answer", ""), json.dumps(emb), to_blob(emb), json.dumps(item.get("metadata", {}))),
         )
     conn.commit()
     conn.close()
+    invalidate_index()
 
 
-def _cosine_sim(a: np.ndarray, b: np.ndarray) -> float:
-    if a.size == 0 or b.size == 0:
-        return 0.0
-    denom = (np.linalg.norm(a) * np.linalg.norm(b))
-    if denom == 0.0:
-        return 0.0
-    return float(np.dot(a, b) / denom)
+# ---------------------
+# Vector index
+# ---------------------
+_index: Optional[FaqIndex] = None
+_index_version = None
+_index_lock = threading.Lock()
 
 
-def get_top_k_faqs(query: str, top_k: int = 3, threshold: float = 0.0) -> List[Dict[str, Any]]:
-    """
-    Compute embedding for the query and return top_k FAQ items with score >= threshold.
-    Returns list of dicts: {id,question,answer,metadata,score}
-    """
-    if not query:
-        return []
+def _faqs_version(cur) -> tuple:
+    # cheap change detector so workers pick up FAQs inserted by other processes
+    cur.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM faqs")
+    return tuple(cur.fetchone())
 
-    q_emb = embed_texts([query])[0]
-    qv = np.array(q_emb, dtype=float)
 
+def build_index(rows, mode: str = FAQ_INDEX_MODE) -> FaqIndex:
+    """rows: iterable of sqlite rows with id, embedding_f32 (BLOB) and metadata (JSON)."""
+    rows = list(rows)
+    index = FaqIndex(mode=mode, dims=FAQ_INDEX_DIMS, rescore=FAQ_RESCORE_CANDIDATES)
+    if not rows:
+        return index
+    vectors = np.stack([row_vector(r["embedding_f32"]) for r in rows])
+    metadata = [json.loads(r["metadata"]) if r["metadata"] else {} for r in rows]
+    return index.build([r["id"] for r in rows], vectors, metadata)
+
+
+def get_index() -> FaqIndex:
+    """The process-wide index, rebuilt when the faqs table has changed."""
+    global _index, _index_version
+    conn = get_conn()
+    try:
+        cur = conn.cursor()
+        version = _faqs_version(cur)
+        if _index is not None and version == _index_version:
+            return _index
+        with _index_lock:
+            if _index is None or version != _index_version:
+                _backfill_vector_blobs(cur)
+                conn.commit()
+                cur.execute("SELECT id, embedding_f32, metadata FROM faqs ORDER BY id")
+                _index = build_index(cur.fetchall())
+                _index_version = version
+                logger.info("Built %s FAQ index: %d rows, %d bytes", FAQ_INDEX_MODE, len(_index), _index.nbytes)
+            return _index
+    finally:
+        conn.close()
+
+
+def invalidate_index():
+    global _index, _index_version
+    with _index_lock:
+        _index, _index_version = None, None
+
+
+def _full_vectors(ids: List[int]) -> Dict[int, np.ndarray]:
+    """Full-precision (float32) embeddings for a rescoring shortlist."""
+    if not ids:
+        return {}
+    conn = get_conn()
+    try:
+        return load_vectors(conn, ids)
+    finally:
+        conn.close()
+
+
+def _load_faqs(hits: List[tuple]) -> List[Dict[str, Any]]:
+    """Fetch question/answer/metadata for [(id, score)] hits, preserving order."""
+    if not hits:
+        return []
+    ids = [h[0] for h in hits]
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute("SELECT id, question, answer, embedding, metadata FROM faqs")
-    rows = cur.fetchall()
-    scored = []
-    for r in rows:
-        emb = np.array(json.loads(r["embedding"]), dtype=float)
-        score = _cosine_sim(qv, emb)
-        scored.append(
+    cur.execute(f"SELECT id, question, answer, metadata FROM faqs WHERE id IN ({','.join('?' * len(ids))})", ids)
+    by_id = {r["id"]: r for r in cur.fetchall()}
+    conn.close()
+    results = []
+    for faq_id, score in hits:
+        r = by_id.get(faq_id)
+        if r is None:
+            continue
+        results.append(
             {
                 "id": r["id"],
                 "question": r["question"],
@@ -147,33 +288,338 @@ def get_top_k_faqs(query: str, top_k: int = 3, threshold: float = 0.0) -> List[D
                 "score": score,
             }
         )
-    conn.close()
+    return results
+
+
+_WORD_RE = re.compile(r"[a-z0-9']+")
 
+
+def _tokens(text: str) -> set:
+    return set(_WORD_RE.findall(text.lower()))
+
+
+def filters_for_session(session_metadata: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """FAQ search filters derived from a session's metadata (only FAQ_FILTER_KEYS are used)."""
+    if not session_metadata:
+        return {}
+    return {k: session_metadata[k] for k in FAQ_FILTER_KEYS if session_metadata.get(k) not in (None, "", [])}
+
+
+def _matches(metadata: Dict[str, Any], filters: Dict[str, Any]) -> bool:
+    for key, wanted in filters.items():
+        wanted = {str(v) for v in wanted} if isinstance(wanted, (list, tuple, set)) else {str(wanted)}
+        have = metadata.get(key)
+        if have is None or isinstance(have, dict):
+            return False  # not indexed by FaqIndex either
+        have = {str(v) for v in have} if isinstance(have, (list, tuple, set)) else {str(have)}
+        if not wanted & have:
+            return False
+    return True
+
+
+def _keyword_top_k(query: str, top_k: int = 3, filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Fallback search used when embeddings are unavailable: score = share of query
+    words that appear in the FAQ question/answer. Scores are not comparable with
+    cosine similarity, hence the separate KEYWORD_MIN_SCORE threshold.
+    """
+    q_tokens = _tokens(query)
+    if not q_tokens:
+        return []
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT id, question, answer, metadata FROM faqs")
+    rows = cur.fetchall()
+    conn.close()
+    scored = []
+    for r in rows:
+        metadata = json.loads(r["metadata"]) if r["metadata"] else {}
+        if filters and not _matches(metadata, filters):
+            continue
+        score = len(q_tokens & _tokens(r["question"] + " " + r["answer"])) / len(q_tokens)
+        if score >= KEYWORD_MIN_SCORE:
+            scored.append(
+                {
+                    "id": r["id"],
+                    "question": r["question"],
+                    "answer": r["answer"],
+                    "metadata": metadata,
+                    "score": score,
+                }
+            )
     scored.sort(key=lambda x: x["score"], reverse=True)
-    filtered = [s for s in scored if s["score"] >= threshold]
-    return filtered[:top_k]
+    return scored[:top_k]
+
+
+def get_top_k_faqs(
+    query: str, top_k: int = 3, threshold: float = 0.0, filters: Optional[Dict[str, Any]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Compute embedding for the query and return top_k FAQ items with score >= threshold.
+    `filters` (e.g. {"tenant": "acme"}) limits the search to FAQs whose metadata matches;
+    only rows in the matching index partitions are scored.
+    Returns list of dicts: {id,question,answer,metadata,score}
+    """
+    if not query:
+        return []
+
+    try:
+        with stage("faq.embed"):
+            q_emb = embed_texts([query])[0]
+    except UpstreamUnavailable as e:
+        # embeddings provider is unhealthy: degrade to lexical matching instead of failing the turn
+        logger.warning("Embedding search unavailable, using keyword fallback: %s", e)
+        return _keyword_top_k(query, top_k, filters)
+    qv = np.array(q_emb, dtype=float)
+
+    with stage("faq.index_search"):
+        hits = get_index().search(qv, top_k, threshold, full_vectors=_full_vectors, filters=filters)
+    with stage("faq.load_rows"):
+        return _load_faqs(hits)
 
 
 # ---------------------
 # message/session helpers
 # ---------------------
-def save_message(session_id: str, role: str, content: str):
+def _history_key(session_id: str) -> str:
+    return make_key("history", str(session_id))
+
+
+def _last_message_id(cur, session_id: str) -> Optional[int]:
+    cur.execute("SELECT MAX(id) FROM messages WHERE session_id = ?", (session_id,))
+    return cur.fetchone()[0]
+
+
+def _append_history(session_id: str, prev_id: Optional[int], message_id: int, message: Dict[str, Any]):
+    """
+    Write-through for the cached history window: {"last_id", "complete", "messages"}.
+    The new message is appended only if the window ends at the message written just
+    before it (prev_id); otherwise another writer got in between and the window is dropped.
+    """
+    key = _history_key(session_id)
+    window = cache.get(key)
+    if window is None:
+        return
+    if window["last_id"] != prev_id:
+        cache.invalidate(key)
+        return
+    messages = window["messages"] + [message]
+    complete = window["complete"] and len(messages) <= HISTORY_CACHE_WINDOW
+    cache.set(
+        key,
+        {"last_id": message_id, "complete": complete, "messages": messages[-HISTORY_CACHE_WINDOW:]},
+        ttl=HISTORY_CACHE_TTL,
+    )
+
+
+def _insert_message(cur, session_id: str, role: str, content: str, escalated: bool = False):
+    """Insert a message; returns (previous last id of the session, new id, message dict)."""
+    prev_id = _last_message_id(cur, session_id)
+    cur.execute(
+        "INSERT INTO messages (session_id, role, content, escalated) VALUES (?, ?, ?, ?)",
+        (session_id, role, content, int(escalated)),
+    )
+    message_id = cur.lastrowid
+    cur.execute("SELECT created_at FROM messages WHERE id = ?", (message_id,))
+    return prev_id, message_id, {"role": role, "content": content, "created_at": cur.fetchone()[0]}
+
+
+def get_session(session_id: str) -> Optional[Dict[str, Any]]:
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT id, user_id, metadata FROM sessions WHERE id = ?", (session_id,))
+    row = cur.fetchone()
+    conn.close()
+    if row is None:
+        return None
+    return {
+        "id": row["id"],
+        "user_id": row["user_id"] or None,
+        "metadata": json.loads(row["metadata"]) if row["metadata"] else {},
+    }
+
+
+def save_message(session_id: str, role: str, content: str) -> int:
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute("INSERT INTO messages (session_id, role, content) VALUES (?, ?, ?)", (session_id, role, content))
+    prev_id, message_id, message = _insert_message(cur, session_id, role, content)
     conn.commit()
     conn.close()
+    _append_history(session_id, prev_id, message_id, message)
+    return message_id
+
+
+def delete_message(session_id: str, message_id: int):
+    conn = get_conn()
+    conn.execute("DELETE FROM messages WHERE id = ? AND session_id = ?", (message_id, session_id))
+    conn.commit()
+    conn.close()
+    cache.invalidate(_history_key(session_id))
+
+
+def record_turn(
+    session_id: str,
+    reply: str,
+    *,
+    escalated: bool = False,
+    escalation_rule: Optional[str] = None,
+    topic: str = "",
+    faq_hit: bool = False,
+    llm_calls: int = 0,
+    llm_latency_ms: float = 0.0,
+    tokens: int = 0,
+) -> int:
+    """
+    Persist the assistant reply for a turn and, in the same transaction, its escalation
+    event + outbox entry (if any) and the hourly rollup increments. Returns the message id.
+    The outbox row is picked up by the dispatcher in outbox.py.
+    """
+    conn = get_conn()
+    try:
+        cur = conn.cursor()
+        prev_id, message_id, message = _insert_message(cur, session_id, "assistant", reply, escalated)
+        if escalated:
+            analytics.record_escalation(cur, session_id, message_id, escalation_rule or "model", topic)
+            cur.execute(
+                "INSERT INTO escalation_outbox (idempotency_key, session_id, message_id, rule) VALUES (?, ?, ?, ?)",
+                (f"escalation-{message_id}", session_id, message_id, escalation_rule or "model"),
+            )
+        analytics.bump_hourly(
+            cur,
+            topic,
+            messages=1,
+            escalations=int(escalated),
+            faq_lookups=1,
+            faq_hits=int(faq_hit),
+            llm_calls=llm_calls,
+            llm_latency_ms=llm_latency_ms,
+            tokens=tokens,
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    _append_history(session_id, prev_id, message_id, message)
+    return message_id
+
+
+def record_llm_usage(topic: str = "", llm_calls: int = 0, llm_latency_ms: float = 0.0, tokens: int = 0):
+    """Add LLM work done after record_turn (e.g. the per-turn summary) to the hourly rollup."""
+    conn = get_conn()
+    try:
+        analytics.bump_hourly(conn.cursor(), topic, llm_calls=llm_calls, llm_latency_ms=llm_latency_ms, tokens=tokens)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_stats(hours: int = 24, group_by: str = "hour", topic: Optional[str] = None) -> List[Dict[str, Any]]:
+    conn = get_conn()
+    try:
+        return analytics.read_stats(conn.cursor(), hours=hours, group_by=group_by, topic=topic)
+    finally:
+        conn.close()
 
 
 def get_recent_messages(session_id: str, limit: int = 20):
     """
     Returns messages in chronological order (oldest -> newest) up to limit.
+    Served from the session's cached window (kept current by save_message/record_turn)
+    when it holds enough messages.
     """
+    key = _history_key(session_id)
+    window = cache.get(key) if limit <= HISTORY_CACHE_WINDOW else None
+    if window is not None and (window["complete"] or len(window["messages"]) >= limit):
+        return window["messages"][-limit:]
+
+    fetch = max(limit, HISTORY_CACHE_WINDOW)
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute("SELECT role, content, created_at FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?", (session_id, limit))
+    cur.execute("SELECT id, role, content, created_at FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?", (session_id, fetch))
     rows = cur.fetchall()
     conn.close()
     # reverse to chronological
     rows = list(rows)[::-1]
-    return [{"role": r["role"], "content": r["content"], "created_at": r["created_at"]} for r in rows]
+    result = [{"role": r["role"], "content": r["content"], "created_at": r["created_at"]} for r in rows]
+    if limit <= HISTORY_CACHE_WINDOW:
+        cache.set(
+            key,
+            {"last_id": rows[-1]["id"] if rows else None, "complete": len(rows) < fetch, "messages": result},
+            ttl=HISTORY_CACHE_TTL,
+        )
+    return result[-limit:]
+
+
+# ---------------------
+# summary helpers
+# ---------------------
+def find_sessions_to_summarize(idle_minutes: int = 30, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Sessions that are finished (no message for `idle_minutes`) and either have no
+    summary yet or got new messages since their summary was written.
+    Returns [{session_id, last_message_id, message_count}] oldest first.
+    """
+    conn = get_conn()
+    cur = conn.cursor()
+    sql = """
+        SELECT m.session_id AS session_id, MAX(m.id) AS last_message_id, COUNT(*) AS message_count
+        FROM messages m
+        LEFT JOIN session_summaries s ON s.session_id = m.session_id
+        WHERE m.session_id IS NOT NULL
+        GROUP BY m.session_id
+        HAVING (MAX(s.last_message_id) IS NULL OR MAX(m.id) > MAX(s.last_message_id))
+           AND MAX(m.created_at) <= datetime('now', ?)
+        ORDER BY MAX(m.id)
+    """
+    params: list = [f"-{int(idle_minutes)} minutes"]
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    cur.execute(sql, params)
+    rows = cur.fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+
+def get_transcript(session_id: str, up_to_id: Optional[int] = None, limit: int = 80) -> List[Dict[str, Any]]:
+    """Last `limit` messages of a session (chronological), optionally only up to message id `up_to_id`."""
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT id, role, content FROM messages WHERE session_id = ? AND id <= ? ORDER BY id DESC LIMIT ?",
+        (session_id, up_to_id if up_to_id is not None else 2**62, limit),
+    )
+    rows = cur.fetchall()
+    conn.close()
+    return [dict(r) for r in reversed(rows)]
+
+
+def save_summary(session_id: str, summary: str, next_action: Optional[str], last_message_id: int):
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute(
+        """
+        INSERT INTO session_summaries (session_id, summary, next_action, last_message_id, updated_at)
+        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(session_id) DO UPDATE SET
+            summary = excluded.summary,
+            next_action = excluded.next_action,
+            last_message_id = excluded.last_message_id,
+            updated_at = excluded.updated_at
+        WHERE excluded.last_message_id >= session_summaries.last_message_id
+        """,
+        (session_id, summary, next_action, last_message_id),
+    )
+    conn.commit()
+    conn.close()
+
+
+def get_summary(session_id: str) -> Optional[Dict[str, Any]]:
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT summary, next_action, last_message_id, updated_at FROM session_summaries WHERE session_id = ?",
+        (session_id,),
+    )
+    row = cur.fetchone()
+    conn.close()
+    return dict(row) if row else None
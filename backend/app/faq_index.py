@@ -0,0 +1,185 @@
+# backend/app/faq_index.py
+"""
+In-memory FAQ vector index used by faq.get_top_k_faqs.
+
+Modes (FAQ_INDEX_MODE):
+  exact    - float32 unit vectors, full scan (no rescoring)
+  int8     - per-vector scalar-quantized int8 codes for the first pass (~4x smaller than float32)
+  truncate - Matryoshka truncation to the first FAQ_INDEX_DIMS dims (text-embedding-3 models
+             are trained so that prefixes remain usable embeddings)
+
+Quantized modes keep no full-precision vectors in memory: the first pass returns a
+shortlist of `rescore` candidates and the caller supplies their full vectors for exact
+rescoring (see FaqIndex.search).
+
+Metadata partitions: for every (key, value) pair in the FAQ metadata the index keeps a
+sorted array of row positions, so a filtered search only scores matching rows.
+
+Full vectors live in faqs.embedding_f32 as little-endian float32 BLOBs (to_blob); reading
+a 32-row shortlist with load_vectors is a single indexed query with no JSON decoding.
+"""
+import json
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+MODES = ("exact", "int8", "truncate")
+
+
+def _normalize(m: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(m, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return m / norms
+
+
+def to_blob(vector: Sequence[float]) -> bytes:
+    return np.asarray(vector, dtype="<f4").tobytes()
+
+
+def row_vector(blob: Optional[bytes], embedding_json: Optional[str] = None) -> np.ndarray:
+    """Vector of a faqs row: the float32 BLOB, or the legacy JSON text for rows not yet backfilled."""
+    if blob is not None:
+        return np.frombuffer(blob, dtype="<f4")
+    return np.asarray(json.loads(embedding_json), dtype=np.float32)
+
+
+def load_vectors(conn, ids: Sequence[int]) -> Dict[int, np.ndarray]:
+    """Full vectors for `ids` from the faqs table of `conn` (the rescoring read path)."""
+    if not ids:
+        return {}
+    rows = conn.execute(
+        f"SELECT id, embedding_f32, CASE WHEN embedding_f32 IS NULL THEN embedding END FROM faqs WHERE id IN ({','.join('?' * len(ids))})",
+        list(ids),
+    ).fetchall()
+    return {r[0]: row_vector(r[1], r[2]) for r in rows}
+
+
+class FaqIndex:
+    def __init__(self, mode: str = "exact", dims: int = 256, rescore: int = 32):
+        if mode not in MODES:
+            raise ValueError(f"Unknown FAQ index mode: {mode} (expected one of {MODES})")
+        self.mode = mode
+        self.dims = dims
+        self.rescore = rescore
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.codes: Optional[np.ndarray] = None
+        self.scales: Optional[np.ndarray] = None
+        self.partitions: Dict[Tuple[str, str], np.ndarray] = {}
+
+    def build(self, ids: Sequence[int], vectors: np.ndarray, metadata: Optional[Sequence[Dict[str, Any]]] = None) -> "FaqIndex":
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.partitions = self._build_partitions(metadata or [])
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32).reshape(len(self.ids), -1))
+        if self.mode == "exact":
+            self.codes = vectors
+        elif self.mode == "truncate":
+            self.codes = _normalize(vectors[:, : self.dims].copy())
+        else:
+            # symmetric per-row scale so the largest |component| maps to 127
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            self.codes = np.round(vectors / scales[:, None]).astype(np.int8)
+            self.scales = scales.astype(np.float32)
+        return self
+
+    @staticmethod
+    def _values(value: Any) -> List[str]:
+        # list-valued metadata (e.g. {"products": ["a", "b"]}) lands in every listed partition
+        if isinstance(value, (list, tuple, set)):
+            return [str(v) for v in value]
+        return [str(value)]
+
+    def _build_partitions(self, metadata: Sequence[Dict[str, Any]]) -> Dict[Tuple[str, str], np.ndarray]:
+        positions: Dict[Tuple[str, str], List[int]] = {}
+        for pos, meta in enumerate(metadata):
+            for key, value in (meta or {}).items():
+                if isinstance(value, dict) or value is None:
+                    continue
+                for v in self._values(value):
+                    positions.setdefault((key, v), []).append(pos)
+        return {k: np.asarray(v, dtype=np.int64) for k, v in positions.items()}
+
+    def rows_for(self, filters: Dict[str, Any]) -> np.ndarray:
+        """
+        Row positions matching every filter key (AND). A filter value may be a list,
+        meaning any of those values (OR). Unknown keys/values match nothing.
+        """
+        rows: Optional[np.ndarray] = None
+        for key, value in filters.items():
+            parts = [self.partitions.get((key, v)) for v in self._values(value)]
+            parts = [p for p in parts if p is not None]
+            if not parts:
+                return np.zeros(0, dtype=np.int64)
+            match = parts[0] if len(parts) == 1 else np.unique(np.concatenate(parts))
+            rows = match if rows is None else np.intersect1d(rows, match, assume_unique=True)
+            if len(rows) == 0:
+                break
+        return rows if rows is not None else np.arange(len(self.ids))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        total = self.ids.nbytes
+        if self.codes is not None:
+            total += self.codes.nbytes
+        if self.scales is not None:
+            total += self.scales.nbytes
+        total += sum(p.nbytes for p in self.partitions.values())
+        return total
+
+    def first_pass(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Approximate cosine scores for all rows (or only `rows`, positions into the index)."""
+        q = _normalize(np.asarray(query, dtype=np.float32))
+        codes = self.codes if rows is None else self.codes[rows]
+        if self.mode == "exact":
+            return codes @ q
+        if self.mode == "truncate":
+            return codes @ _normalize(q[: self.dims].copy())
+        scales = self.scales if rows is None else self.scales[rows]
+        return (codes @ q) * scales
+
+    def search(
+        self,
+        query: np.ndarray,
+        top_k: int,
+        threshold: float = 0.0,
+        full_vectors: Optional[Callable[[List[int]], Dict[int, np.ndarray]]] = None,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> List[Tuple[int, float]]:
+        """
+        Returns [(faq_id, score)] best first, score >= threshold.
+        `filters` ({"tenant": "acme"}) restricts the scan to matching partitions.
+        `full_vectors(ids) -> {id: vector}` is required for quantized modes; scores of the
+        shortlist are recomputed from those full-precision vectors.
+        """
+        if len(self) == 0 or top_k <= 0:
+            return []
+        rows = self.rows_for(filters) if filters else None
+        ids = self.ids if rows is None else self.ids[rows]
+        if len(ids) == 0:
+            return []
+        approx = self.first_pass(query, rows)
+
+        shortlist_size = top_k if self.mode == "exact" else max(top_k, self.rescore)
+        if shortlist_size < len(approx):
+            shortlist = np.argpartition(-approx, shortlist_size - 1)[:shortlist_size]
+        else:
+            shortlist = np.arange(len(approx))
+
+        if self.mode == "exact" or full_vectors is None:
+            scored = [(int(ids[i]), float(approx[i])) for i in shortlist]
+        else:
+            q = _normalize(np.asarray(query, dtype=np.float64))
+            vectors = full_vectors([int(ids[i]) for i in shortlist])
+            scored = []
+            for i in shortlist:
+                v = vectors.get(int(ids[i]))
+                if v is None:
+                    continue
+                norm = np.linalg.norm(v)
+                scored.append((int(ids[i]), float(np.dot(q, v) / norm) if norm else 0.0))
+
+        scored.sort(key=lambda x: x[1], reverse=True)
+        return [s for s in scored if s[1] >= threshold][:top_k]
@@ -0,0 +1,167 @@
+# backend/app/index_report.py
+"""
+Compare FAQ index modes against exact float64 search.
+
+    python -m app.index_report                    # FAQs in the DB, queries = noisy copies of FAQ vectors
+    python -m app.index_report --synthetic 20000  # random unit vectors, no DB / API needed
+    python -m app.index_report --queries q.txt    # one query per line, embedded via the API
+
+Reports per mode: index memory, mean query latency (first pass + rescoring) and
+recall@k against the exact top-k. Rescoring reads the shortlist's full vectors from
+SQLite through faq_index.load_vectors, with a fresh connection per query like
+faq._full_vectors does; --synthetic vectors are written to a temporary faqs table.
+"""
+import os
+import json
+import time
+import sqlite3
+import argparse
+import tempfile
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from .faq_index import FaqIndex, MODES, load_vectors, row_vector, to_blob
+
+
+def _baseline_top_k(vectors: np.ndarray, query: np.ndarray, k: int) -> List[int]:
+    # what get_top_k_faqs used to do: float64 cosine against every row
+    norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query)
+    norms[norms == 0] = 1.0
+    scores = (vectors @ query) / norms
+    return list(np.argsort(-scores)[:k])
+
+
+def _temp_vector_db(vectors: np.ndarray) -> str:
+    """faqs-shaped table (id, embedding, embedding_f32) holding `vectors` under ids 0..n-1."""
+    fd, path = tempfile.mkstemp(prefix="index_report-", suffix=".db")
+    os.close(fd)
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE faqs (id INTEGER PRIMARY KEY, embedding TEXT, embedding_f32 BLOB)")
+    conn.executemany("INSERT INTO faqs (id, embedding_f32) VALUES (?, ?)", [(i, to_blob(v)) for i, v in enumerate(vectors)])
+    conn.commit()
+    conn.close()
+    return path
+
+
+def evaluate(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    k: int,
+    dims: int,
+    rescore: int,
+    ids: Optional[List[int]] = None,
+    connect: Optional[Callable[[], sqlite3.Connection]] = None,
+) -> Dict[str, Dict]:
+    """
+    `ids` / `connect` point at the faqs table holding `vectors` (defaults: a temporary
+    table with ids 0..n-1). Recall is measured against positions, so ids only matter
+    for the rescoring reads.
+    """
+    vectors = np.asarray(vectors, dtype=np.float64)
+    temp_path = None
+    if connect is None:
+        temp_path = _temp_vector_db(vectors)
+        ids = list(range(len(vectors)))
+        connect = lambda: sqlite3.connect(temp_path)  # noqa: E731
+    ids = np.asarray(ids if ids is not None else range(len(vectors)), dtype=np.int64)
+    position = {int(faq_id): pos for pos, faq_id in enumerate(ids)}
+
+    def full_vectors(shortlist: List[int]) -> Dict[int, np.ndarray]:
+        conn = connect()
+        try:
+            return load_vectors(conn, shortlist)
+        finally:
+            conn.close()
+
+    truth = [_baseline_top_k(vectors, q, k) for q in queries]
+
+    started = time.perf_counter()
+    for q in queries:
+        _baseline_top_k(vectors, q, k)
+    baseline_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+    report = {
+        "float64_full_scan": {
+            "memory_bytes": int(vectors.nbytes),
+            "latency_ms": round(baseline_ms, 3),
+            f"recall@{k}": 1.0,
+        }
+    }
+    try:
+        for mode in MODES:
+            index = FaqIndex(mode=mode, dims=dims, rescore=rescore).build(ids, vectors)
+            hits = []
+            started = time.perf_counter()
+            for q in queries:
+                hits.append(index.search(q, k, threshold=-1.0, full_vectors=full_vectors))
+            latency_ms = (time.perf_counter() - started) * 1000 / len(queries)
+            recall = np.mean([len({position[h[0]] for h in hit} & set(t)) / len(t) for hit, t in zip(hits, truth)])
+            report[mode] = {
+                "memory_bytes": int(index.nbytes),
+                "memory_saved_vs_float64": round(1 - index.nbytes / vectors.nbytes, 3),
+                "latency_ms": round(latency_ms, 3),
+                f"recall@{k}": round(float(recall), 4),
+            }
+    finally:
+        if temp_path:
+            os.remove(temp_path)
+    return report
+
+
+def _load_db_vectors():
+    """(ids, vectors) of the FAQs in the DB."""
+    from . import faq
+
+    conn = faq.get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT id, embedding_f32, embedding FROM faqs ORDER BY id")
+    rows = cur.fetchall()
+    conn.close()
+    vectors = np.array([row_vector(r["embedding_f32"], r["embedding"]) for r in rows], dtype=np.float64)
+    return [r["id"] for r in rows], vectors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FAQ index memory / latency / recall report.")
+    parser.add_argument("--synthetic", type=int, default=0, help="use N random vectors instead of the DB")
+    parser.add_argument("--dim", type=int, default=1536, help="dimension for --synthetic")
+    parser.add_argument("--queries", help="file with one query per line (embedded via the API)")
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.5, help="noise added to FAQ vectors to make queries")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--dims", type=int, default=256, help="truncate mode dimensions")
+    parser.add_argument("--rescore", type=int, default=32, help="rescoring shortlist size")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    ids, connect = None, None
+    if args.synthetic:
+        vectors = rng.normal(size=(args.synthetic, args.dim))
+    else:
+        from .faq import get_conn
+
+        ids, vectors = _load_db_vectors()
+        connect = get_conn
+    if len(vectors) == 0:
+        raise SystemExit("No FAQ vectors found (seed FAQs or use --synthetic N).")
+
+    if args.queries:
+        from .faq import embed_texts
+
+        with open(args.queries, "r", encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+        queries = np.array(embed_texts(texts), dtype=np.float64)
+    else:
+        picks = rng.integers(0, len(vectors), size=args.num_queries)
+        base = vectors[picks] / np.linalg.norm(vectors[picks], axis=1, keepdims=True)
+        queries = base + rng.normal(scale=args.noise / np.sqrt(vectors.shape[1]), size=base.shape)
+
+    report = evaluate(
+        vectors, queries, k=min(args.k, len(vectors)), dims=args.dims, rescore=args.rescore, ids=ids, connect=connect
+    )
+    print(json.dumps({"rows": len(vectors), "dim": int(vectors.shape[1]), "queries": len(queries), "modes": report}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,10 @@
 # backend/app/llm_client.py
 import os
 import json
+import time
 import logging
-from typing import Dict, Any, Optional
-from tenacity import retry, wait_exponential, stop_after_attempt, retry_if_exception_type
+import threading
+from typing import Dict, Any, Optional, Tuple
 from dotenv import load_dotenv
 
 # load .env (ensure backend/.env is loaded)
@@ -12,6 +13,11 @@ load_dotenv(dotenv_path=os.path.join(os.path.dirname(os.path.dirname(__file__)),
 # New OpenAI client
 from openai import OpenAI
 
+from .cache import cache, make_key
+from .admission import AdmissionRejected, llm_limiter
+from .resilience import UpstreamUnavailable, chat_policy
+from .profiling import stage
+
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
@@ -20,11 +26,19 @@ if not OPENAI_API_KEY:
     logger.warning("OPENAI_API_KEY not set. LLM calls will fail until set.")
 
 # instantiate client (reads OPENAI_API_KEY from env automatically)
-client = OpenAI(api_key=OPENAI_API_KEY)
+# SDK-level retries are disabled: resilience.py owns retries, timeouts and the circuit breaker.
+client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
 
 # Choose model(s) via env override if you want
-CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-3.5-turbo")  # change to preferred model
+# Cascade: turns start on FAST_MODEL and are retried on STRONG_MODEL only when they look hard
+# up front or the fast answer fails validation (see route_model / _needs_escalation).
+FAST_MODEL = os.getenv("FAST_MODEL", os.getenv("OPENAI_MODEL", "gpt-4o-mini"))
+STRONG_MODEL = os.getenv("STRONG_MODEL", "gpt-4o")
+# Summaries use the fast tier unless overridden (previously defaulted to gpt-3.5-turbo)
+CHAT_MODEL = os.getenv("CHAT_MODEL", FAST_MODEL)
 # Note: embeddings model separate; faq.py will use embeddings
+# Identical prompts (same history + FAQs + question) reuse the previous reply for this long.
+REPLY_CACHE_TTL = float(os.getenv("REPLY_CACHE_TTL", "600"))
 
 SYSTEM_PROMPT = """
 You are an AI customer-support assistant. You should answer user queries concisely,
@@ -38,19 +52,130 @@ IMPORTANT: Your final response must be valid JSON (and only JSON) with the follo
 }
 """
 
-# Retry policy for transient OpenAI issues
-@retry(wait=wait_exponential(min=1, max=8), stop=stop_after_attempt(3), retry=retry_if_exception_type(Exception))
+# ---------------------
+# Model routing
+# ---------------------
+ROUTER_FAQ_CONFIDENT = float(os.getenv("ROUTER_FAQ_CONFIDENT", "0.8"))
+ROUTER_LONG_MESSAGE_CHARS = int(os.getenv("ROUTER_LONG_MESSAGE_CHARS", "400"))
+ROUTER_DEEP_CONVERSATION = int(os.getenv("ROUTER_DEEP_CONVERSATION", "12"))
+# number of "hard" signals needed to skip the fast tier entirely
+ROUTER_STRONG_SIGNALS = int(os.getenv("ROUTER_STRONG_SIGNALS", "2"))
+ROUTER_MIN_REPLY_CHARS = int(os.getenv("ROUTER_MIN_REPLY_CHARS", "8"))
+
+LOW_CONFIDENCE_PHRASES = [
+    "i'm not sure", "i am not sure", "i don't know", "i do not know", "not certain",
+    "i cannot help", "i can't help", "unable to determine", "as an ai",
+]
+
+# USD per 1M tokens: (input, output). Override with MODEL_PRICES='{"model": [in, out]}'
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+}
+MODEL_PRICES.update({k: tuple(v) for k, v in json.loads(os.getenv("MODEL_PRICES", "{}")).items()})
+
+_router_lock = threading.Lock()
+_router_stats: Dict[str, Dict[str, float]] = {
+    tier: {"calls": 0, "escalated_from_fast": 0, "latency_ms": 0.0, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0}
+    for tier in ("fast", "strong")
+}
+_router_routed = {"fast": 0, "strong": 0}
+# what the same traffic would have cost had every call gone to STRONG_MODEL
+_router_all_strong_cost = 0.0
+
+
+def _cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    price_in, price_out = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * price_in + completion_tokens * price_out) / 1_000_000
+
+
+def route_model(user_message: str, faq_top_score: Optional[float] = None, conversation_depth: int = 0) -> str:
+    """
+    Pick a starting tier from cheap signals: weak/no FAQ match, long message, deep conversation.
+    Returns "fast" or "strong".
+    """
+    signals = 0
+    if faq_top_score is None or faq_top_score < ROUTER_FAQ_CONFIDENT:
+        signals += 1
+    if len(user_message) > ROUTER_LONG_MESSAGE_CHARS:
+        signals += 1
+    if conversation_depth >= ROUTER_DEEP_CONVERSATION:
+        signals += 1
+    return "strong" if signals >= ROUTER_STRONG_SIGNALS else "fast"
+
+
+def _needs_escalation(text: str, finish_reason: Optional[str]) -> bool:
+    """Validation for fast-tier answers: empty/very short, truncated, or hedging."""
+    if len(text.strip()) < ROUTER_MIN_REPLY_CHARS:
+        return True
+    if finish_reason == "length":
+        return True
+    lower = text.lower().replace("’", "'")
+    return any(p in lower for p in LOW_CONFIDENCE_PHRASES)
+
+
+def _record_tier_call(tier: str, model: str, latency_ms: float, usage, escalated_from_fast: bool = False):
+    global _router_all_strong_cost
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    with _router_lock:
+        st = _router_stats[tier]
+        st["calls"] += 1
+        st["escalated_from_fast"] += int(escalated_from_fast)
+        st["latency_ms"] += latency_ms
+        st["prompt_tokens"] += prompt_tokens
+        st["completion_tokens"] += completion_tokens
+        st["cost_usd"] += _cost(model, prompt_tokens, completion_tokens)
+        # baseline: one STRONG_MODEL call per turn (the escalation retry replaces the fast call)
+        if not escalated_from_fast:
+            _router_all_strong_cost += _cost(STRONG_MODEL, prompt_tokens, completion_tokens)
+    return prompt_tokens + completion_tokens
+
+
+def router_metrics() -> Dict[str, Any]:
+    with _router_lock:
+        tiers = {}
+        for tier, st in _router_stats.items():
+            calls = st["calls"]
+            tiers[tier] = {
+                "model": FAST_MODEL if tier == "fast" else STRONG_MODEL,
+                "routed": _router_routed[tier],
+                "calls": calls,
+                "escalated_from_fast": st["escalated_from_fast"],
+                "avg_latency_ms": round(st["latency_ms"] / calls, 1) if calls else None,
+                "prompt_tokens": st["prompt_tokens"],
+                "completion_tokens": st["completion_tokens"],
+                "cost_usd": round(st["cost_usd"], 6),
+            }
+        actual = sum(st["cost_usd"] for st in _router_stats.values())
+        return {
+            "tiers": tiers,
+            "cost_usd": round(actual, 6),
+            "all_strong_cost_usd": round(_router_all_strong_cost, 6),
+            "saved_usd": round(_router_all_strong_cost - actual, 6),
+        }
+
+
+def _create_chat_completion(timeout: float, **kwargs):
+    with llm_limiter.slot():
+        return client.chat.completions.create(timeout=timeout, **kwargs)
+
+
 def _call_chat_api(messages, temperature=0.15, max_tokens=800):
     """
     Uses the new OpenAI client: client.chat.completions.create(...)
+    Retries, timeouts and fail-fast behaviour come from resilience.chat_policy.
     """
-    resp = client.chat.completions.create(
-        model=CHAT_MODEL,
-        messages=messages,
-        temperature=temperature,
-        max_tokens=max_tokens,
+    return chat_policy.call(
+        lambda timeout: _create_chat_completion(
+            timeout,
+            model=CHAT_MODEL,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+        )
     )
-    return resp
 
 def _extract_json_from_text(text: str) -> Optional[Dict[str, Any]]:
     text = text.strip()
@@ -116,11 +241,38 @@ def _extract_choice_content(choice) -> str:
     except Exception:
         return ""
 
-async def generate_response(user_message: str, conversation_text: str = "", faq_text: str = "", session_meta=None, session_id=None):
+def _fallback_response(faq_text: str = "") -> Dict[str, Any]:
+    """Reply used when the provider is unhealthy: best FAQ match if we have one, else a handoff."""
+    top = faq_text.split("\n\n")[0].strip() if faq_text else ""
+    if top:
+        reply = f"I’m having trouble reaching our assistant right now, but this may help:\n\n{top}"
+    else:
+        reply = "⚠️ I’m having trouble answering right now. Please try again shortly or contact support@example.com."
+    return {
+        "reply": reply,
+        "escalation": False,
+        "summary": None,
+        "faqs": [],
+        "fallback": True,
+    }
+
+
+def generate_response(
+    user_message: str,
+    conversation_text: str = "",
+    faq_text: str = "",
+    session_meta=None,
+    session_id=None,
+    faq_top_score: Optional[float] = None,
+    conversation_depth: Optional[int] = None,
+):
     """
     Generate an AI response with built-in keyword-based escalation.
     If certain keywords appear (refund, complaint, cancel, etc.),
     the bot will immediately escalate with a direct contact message.
+    Otherwise the turn is routed through the fast/strong model cascade
+    (faq_top_score and conversation_depth feed route_model).
+    Blocking: call it from a worker thread, never directly on the event loop.
     """
     escalation_keywords = [
     "hack", "hacked", "hacking", "attack", "attacked", "breach", "breached",
@@ -134,10 +286,12 @@ async def generate_response(user_message: str, conversation_text: str = "", faq_
     lower_msg = user_message.lower()
 
     # 🔹 Detect escalation keywords and short-circuit reply
-    if any(k in lower_msg for k in escalation_keywords):
+    matched = next((k for k in escalation_keywords if k in lower_msg), None)
+    if matched:
         return {
             "reply": "⚠️ I’m unable to assist with that request directly. Please contact support@example.com for further help regarding your issue.",
             "escalation": True,
+            "escalation_rule": f"keyword:{matched.strip()}",
             "summary": f"Escalated issue detected in user message: '{user_message}'",
             "faqs": [],
         }
@@ -153,22 +307,74 @@ async def generate_response(user_message: str, conversation_text: str = "", faq_
 
         messages.append({"role": "user", "content": user_message})
 
-        completion = client.chat.completions.create(
-            model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-            messages=messages,
-            max_tokens=250,
-        )
+        cache_key = make_key("reply", FAST_MODEL, STRONG_MODEL, messages)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return {**cached, "cached": True, "llm_calls": 0, "llm_latency_ms": 0.0, "tokens": 0}
 
-        choice = completion.choices[0]
-        assistant_text = choice.message.content if hasattr(choice, "message") else choice.get("message", {}).get("content", "")
+        if conversation_depth is None:
+            conversation_depth = sum(1 for line in conversation_text.splitlines() if line.startswith("USER:"))
+        tier = route_model(user_message, faq_top_score, conversation_depth)
+        with _router_lock:
+            _router_routed[tier] += 1
 
-        return {
-            "reply": assistant_text.strip(),
+        assistant_text, model, degraded = "", None, False
+        llm_calls, llm_latency_ms, tokens = 0, 0.0, 0
+        for attempt_tier in ([tier] if tier == "strong" else ["fast", "strong"]):
+            attempt_model = FAST_MODEL if attempt_tier == "fast" else STRONG_MODEL
+            started = time.monotonic()
+            try:
+                with stage(f"llm.{attempt_tier}"):
+                    completion = chat_policy.call(
+                        lambda timeout: _create_chat_completion(timeout, model=attempt_model, messages=messages, max_tokens=250)
+                    )
+            except (UpstreamUnavailable, AdmissionRejected):
+                # strong tier unavailable or shed (queue full / deadline) after a weak fast
+                # answer: the fast answer beats a fallback or a 429
+                if assistant_text:
+                    degraded = True
+                    break
+                raise
+            latency_ms = (time.monotonic() - started) * 1000
+            tokens += _record_tier_call(
+                attempt_tier,
+                attempt_model,
+                latency_ms,
+                getattr(completion, "usage", None),
+                escalated_from_fast=attempt_tier == "strong" and tier == "fast",
+            )
+            llm_calls += 1
+            llm_latency_ms += latency_ms
+
+            choice = completion.choices[0]
+            text = choice.message.content if hasattr(choice, "message") else choice.get("message", {}).get("content", "")
+            text = (text or "").strip()
+            if text:
+                assistant_text, model = text, attempt_model
+            if attempt_tier == "fast" and not _needs_escalation(text, getattr(choice, "finish_reason", None)):
+                break
+
+        result = {
+            "reply": assistant_text,
             "escalation": False,
             "summary": None,
             "faqs": [],
+            "model": model,
+            "llm_calls": llm_calls,
+            "llm_latency_ms": llm_latency_ms,
+            "tokens": tokens,
         }
+        # a weak fast answer kept only because the strong tier was unavailable isn't cached
+        if result["reply"] and not degraded:
+            cache.set(cache_key, result, ttl=REPLY_CACHE_TTL)
+        return result
 
+    except AdmissionRejected:
+        # let main.py answer 429/503 instead of a 200 with an error reply
+        raise
+    except UpstreamUnavailable as e:
+        logger.warning("LLM unavailable, answering from FAQs: %s", e)
+        return _fallback_response(faq_text)
     except Exception as e:
         logging.error(f"LLM generate_response failed: {e}")
         return {
@@ -179,6 +385,11 @@ async def generate_response(user_message: str, conversation_text: str = "", faq_
         }
 
 def summarize_session(session_id: int, conversation_text: str) -> Dict[str, Any]:
+    return summarize_session_with_usage(session_id, conversation_text)[0]
+
+
+def summarize_session_with_usage(session_id: int, conversation_text: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """summarize_session plus {"llm_calls", "llm_latency_ms", "tokens"} for the rollups."""
     system = "You are a concise summarizer for customer support transcripts."
     user_prompt = f"Summarize the following conversation in 2-3 sentences and provide a short next action label (one short phrase). Conversation:\n\n{conversation_text}\n\nReturn JSON: {{\"summary\":\"...\",\"next_action\":\"...\"}}"
     messages = [
@@ -186,15 +397,57 @@ def summarize_session(session_id: int, conversation_text: str) -> Dict[str, Any]
         {"role": "user", "content": user_prompt}
     ]
     try:
-        resp = _call_chat_api(messages, temperature=0.0, max_tokens=400)
-        choices = resp.choices if hasattr(resp, "choices") else resp.get("choices", [])
-        if not choices:
-            raise RuntimeError("No choices in summarizer response")
-        text = _extract_choice_content(choices[0])
-        parsed = _extract_json_from_text(text)
+        started = time.monotonic()
+        with stage("llm.summary"):
+            resp = _call_chat_api(messages, temperature=0.0, max_tokens=400)
+        usage = getattr(resp, "usage", None)
+        metered = {
+            "llm_calls": 1,
+            "llm_latency_ms": (time.monotonic() - started) * 1000,
+            "tokens": getattr(usage, "total_tokens", 0) or 0,
+        }
+        with stage("llm.parse"):
+            choices = resp.choices if hasattr(resp, "choices") else resp.get("choices", [])
+            if not choices:
+                raise RuntimeError("No choices in summarizer response")
+            text = _extract_choice_content(choices[0])
+            parsed = _extract_json_from_text(text)
         if parsed:
-            return {"summary": parsed.get("summary", ""), "next_action": parsed.get("next_action")}
-        return {"summary": text.strip(), "next_action": None}
+            return {"summary": parsed.get("summary", ""), "next_action": parsed.get("next_action")}, metered
+        return {"summary": text.strip(), "next_action": None}, metered
     except Exception as e:
         logger.exception("Summarize failed: %s", e)
         raise
+
+def summarize_sessions_batch(conversations: Dict[str, str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Summarize several short transcripts in one request. `conversations` maps
+    session_id -> conversation text. Returns session_id -> {"summary", "next_action"}
+    for every session the model answered; callers should retry missing ids one by one.
+    """
+    if len(conversations) == 1:
+        (sid, text), = conversations.items()
+        return {sid: summarize_session(sid, text)}
+
+    system = "You are a concise summarizer for customer support transcripts."
+    blocks = "\n\n".join(f"### SESSION {sid}\n{text}" for sid, text in conversations.items())
+    user_prompt = (
+        "Summarize each of the following conversations separately in 2-3 sentences and provide a short "
+        f"next action label (one short phrase) for each. Conversations:\n\n{blocks}\n\n"
+        'Return JSON keyed by session id: {"<session id>": {"summary":"...","next_action":"..."}, ...}'
+    )
+    messages = [
+        {"role": "system", "content": system},
+        {"role": "user", "content": user_prompt}
+    ]
+    resp = _call_chat_api(messages, temperature=0.0, max_tokens=min(4000, 250 * len(conversations)))
+    choices = resp.choices if hasattr(resp, "choices") else resp.get("choices", [])
+    if not choices:
+        raise RuntimeError("No choices in summarizer response")
+    parsed = _extract_json_from_text(_extract_choice_content(choices[0])) or {}
+    results = {}
+    for sid in conversations:
+        item = parsed.get(str(sid))
+        if isinstance(item, dict) and item.get("summary"):
+            results[sid] = {"summary": item["summary"], "next_action": item.get("next_action")}
+    return results
@@ -1,17 +1,27 @@
 # backend/app/main.py
 import os
 import json
+import hmac
 import uuid
+import time
+import asyncio
 import logging
+import functools
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, List
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Header, Depends
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-from . import faq
-from .llm_client import client as openai_client, generate_response, summarize_session
+from . import faq, admission, resilience, profiling, outbox
+from .profiling import stage
+from .admission import AdmissionRejected
+from .resilience import UpstreamUnavailable
+from .llm_client import client as openai_client, generate_response, summarize_session, summarize_session_with_usage, router_metrics
 
 # Load environment
 HERE = os.path.dirname(os.path.dirname(__file__))
@@ -25,8 +35,27 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 CONTEXT_WINDOW = int(os.getenv("CONTEXT_WINDOW", "8"))
 TOP_K_FAQ = int(os.getenv("TOP_K_FAQ", "3"))
 FAQ_SIM_THRESHOLD = float(os.getenv("FAQ_SIM_THRESHOLD", "0.7"))
+# Threads that run /message turns. The turn pipeline blocks on OpenAI/SQLite, so it runs
+# off the event loop; sized so the LLM limiter's queue (not this pool) is what fills up.
+TURN_WORKERS = int(os.getenv("TURN_WORKERS", str(admission.LLM_MAX_CONCURRENCY + admission.LLM_MAX_QUEUE)))
+# /admin/* endpoints and the X-Profile header require a matching X-Admin-Token header;
+# with no token configured they are disabled
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 
 app = FastAPI(title="ai-cs-bot backend")
+_turn_executor = ThreadPoolExecutor(max_workers=TURN_WORKERS, thread_name_prefix="turn")
+
+
+def _in_worker(fn, *args):
+    with profiling.follow_thread():
+        return fn(*args)
+
+
+async def run_blocking(fn, *args):
+    """Run fn in the turn pool, carrying contextvars (deadline, profiling stages) along."""
+    ctx = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(_turn_executor, functools.partial(ctx.run, _in_worker, fn, *args))
+
 
 # Allow frontend
 app.add_middleware(
@@ -37,6 +66,60 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    """Per-stage timings for every request; stack sampling when requested/sampled; keep slow ones."""
+    sampler = None
+    forced = profiling.forced(request.headers) and is_admin(request.headers.get("x-admin-token"))
+    if profiling.should_profile(request.headers, allow_forced=forced):
+        sampler = profiling.StackSampler(threading.get_ident(), profiling.settings["interval_ms"]).start()
+    stages_token = profiling.start_stages()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        duration_ms = (time.perf_counter() - started) * 1000
+        timings = profiling.end_stages(stages_token)
+        folded = sampler.stop() if sampler else None
+        slow = duration_ms >= profiling.settings["threshold_ms"]
+        if (sampler and (slow or forced)) or (slow and profiling.settings["capture_slow"]):
+            try:
+                profiling.store.save({
+                    "method": request.method,
+                    "path": request.url.path,
+                    "status": status,
+                    "duration_ms": round(duration_ms, 2),
+                    "captured_at": time.time(),
+                    "stages": timings,
+                    "samples": sampler.samples if sampler else 0,
+                    "folded": folded,
+                })
+            except Exception as e:
+                logger.warning("Failed to store request profile: %s", e)
+
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    retry_after = max(1, int(round(exc.retry_after)))
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.reason},
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
+@app.exception_handler(UpstreamUnavailable)
+async def upstream_unavailable_handler(request: Request, exc: UpstreamUnavailable):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"upstream unavailable: {exc}"},
+        headers={"Retry-After": str(int(resilience.BREAKER_RESET_SECONDS))},
+    )
+
+
 # Pydantic models
 class CreateSessionRequest(BaseModel):
     user_id: Optional[str] = None
@@ -71,6 +154,16 @@ async def startup():
             logger.error(f"❌ OpenAI auth failed: {e}")
     else:
         logger.warning("⚠️ OPENAI_API_KEY not found.")
+    if outbox.ESCALATION_WEBHOOK_URL:
+        app.state.outbox = outbox.Dispatcher().start()
+        logger.info("Escalation outbox dispatcher started.")
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    dispatcher = getattr(app.state, "outbox", None)
+    if dispatcher:
+        dispatcher.stop()
 
 
 @app.get("/health")
@@ -80,6 +173,31 @@ async def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+async def metrics():
+    """Admission queue/rejection counters, upstream health, per-model-tier cost/latency and outbox backlog."""
+    return {
+        "admission": admission.metrics(),
+        "upstream": resilience.metrics(),
+        "router": router_metrics(),
+        "outbox": outbox.stats(),
+    }
+
+
+@app.get("/stats")
+async def stats(hours: int = 24, group_by: str = "hour", topic: Optional[str] = None):
+    """
+    Traffic / escalation / FAQ hit-rate / LLM latency + tokens from the hourly rollups.
+    group_by: hour | topic | hour_topic.
+    """
+    if hours < 1 or hours > 24 * 90:
+        raise HTTPException(status_code=400, detail="hours must be between 1 and 2160")
+    try:
+        return {"hours": hours, "group_by": group_by, "rows": faq.get_stats(hours, group_by, topic)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @app.post("/sessions", response_model=CreateSessionResponse)
 async def create_session(req: CreateSessionRequest):
     session_id = str(uuid.uuid4())
@@ -109,30 +227,68 @@ async def handle_message(req: MessageRequest):
     if not user_message:
         raise HTTPException(status_code=400, detail="user_message cannot be empty")
 
+    # Started before handing off so time spent waiting for a turn thread counts too
+    deadline_token = admission.start_deadline()
+    try:
+        return await run_blocking(_handle_message, session_id, user_message)
+    finally:
+        admission.end_deadline(deadline_token)
+
+
+def _handle_message(session_id: str, user_message: str) -> MessageResponse:
+    # Per-user token bucket (falls back to the session when the session has no user_id)
+    session = faq.get_session(session_id)
+    user_id = session["user_id"] if session else None
+    admission.rate_limiter.check(f"user:{user_id}" if user_id else f"session:{session_id}")
+    return _run_turn(session_id, user_message, session)
+
+
+def _run_turn(session_id: str, user_message: str, session: Optional[dict] = None) -> MessageResponse:
     # Persist user message
-    faq.save_message(session_id, "user", user_message)
+    with stage("persist_user"):
+        user_message_id = faq.save_message(session_id, "user", user_message)
+    try:
+        return _answer(session_id, user_message, session)
+    except AdmissionRejected:
+        # shed before any reply was stored: the client retries after Retry-After, so
+        # drop the question instead of leaving an unanswered duplicate in the history
+        faq.delete_message(session_id, user_message_id)
+        raise
+
 
+def _answer(session_id: str, user_message: str, session: Optional[dict] = None) -> MessageResponse:
     # Build conversation context for LLM
-    recent = faq.get_recent_messages(session_id, limit=CONTEXT_WINDOW * 2)
-    conversation = "\n".join([f"{m['role'].upper()}: {m['content']}" for m in recent]) if recent else ""
+    with stage("history"):
+        recent = faq.get_recent_messages(session_id, limit=CONTEXT_WINDOW * 2)
+        conversation = "\n".join([f"{m['role'].upper()}: {m['content']}" for m in recent]) if recent else ""
 
-    # Retrieve relevant FAQs (embedding search)
-    top_faqs = faq.get_top_k_faqs(user_message, TOP_K_FAQ, FAQ_SIM_THRESHOLD)
-    faq_text = "\n\n".join([f"Q: {f['question']}\nA: {f['answer']}" for f in top_faqs]) if top_faqs else ""
+    # Retrieve relevant FAQs (embedding search), restricted to the session's tenant/product slice
+    with stage("faq_search"):
+        faq_filters = faq.filters_for_session(session["metadata"] if session else None)
+        top_faqs = faq.get_top_k_faqs(user_message, TOP_K_FAQ, FAQ_SIM_THRESHOLD, filters=faq_filters)
+        faq_text = "\n\n".join([f"Q: {f['question']}\nA: {f['answer']}" for f in top_faqs]) if top_faqs else ""
+
+    # Topic for analytics rollups: the session's own topic, else the best FAQ's
+    topic = str((session or {}).get("metadata", {}).get("topic") or (top_faqs[0]["metadata"].get("topic") if top_faqs else None) or "")
 
     # Call the LLM wrapper which now handles keyword escalation internally
     try:
-        result = await generate_response(
-        user_message=user_message,
-        conversation_text=conversation,
-        faq_text=faq_text,
-        session_meta=None,
-        session_id=session_id,
-        )
+        with stage("generate"):
+            result = generate_response(
+            user_message=user_message,
+            conversation_text=conversation,
+            faq_text=faq_text,
+            session_meta=None,
+            session_id=session_id,
+            faq_top_score=top_faqs[0]["score"] if top_faqs else None,
+            conversation_depth=sum(1 for m in recent if m["role"] == "user"),
+            )
+    except AdmissionRejected:
+        raise
     except Exception as e:
         logger.exception("LLM generate_response failed: %s", e)
         fallback = f"Sorry, something went wrong generating a response. ({str(e)})"
-        faq.save_message(session_id, "assistant", fallback)
+        faq.record_turn(session_id, fallback, topic=topic, faq_hit=bool(top_faqs))
         return MessageResponse(reply=fallback, faqs=top_faqs, escalation=False, summary=None)
 
 
@@ -152,14 +308,27 @@ async def handle_message(req: MessageRequest):
     else:
         reply_text = str(result)
 
-    # Persist assistant reply
-    faq.save_message(session_id, "assistant", reply_text)
+    # Persist assistant reply (+ escalation event and hourly rollups, same transaction)
+    with stage("persist_reply"):
+        faq.record_turn(
+            session_id,
+            reply_text,
+            escalated=model_escalate,
+            escalation_rule=result.get("escalation_rule") if isinstance(result, dict) else None,
+            topic=topic,
+            faq_hit=bool(top_faqs),
+            llm_calls=result.get("llm_calls", 0) if isinstance(result, dict) else 0,
+            llm_latency_ms=result.get("llm_latency_ms", 0.0) if isinstance(result, dict) else 0.0,
+            tokens=result.get("tokens", 0) if isinstance(result, dict) else 0,
+        )
 
     # Try to produce/refresh summary if not returned by LLM (best-effort)
     if not summary:
         try:
             convo_for_summary = conversation + "\nASSISTANT: " + reply_text
-            s = summarize_session(session_id, convo_for_summary)
+            with stage("summary"):
+                s, usage = summarize_session_with_usage(session_id, convo_for_summary)
+            faq.record_llm_usage(topic, **usage)
             if isinstance(s, dict):
                 summary = s.get("summary")
         except Exception:
@@ -201,10 +370,78 @@ async def summarize_endpoint(session_id: str = Path(..., description="Session UU
 
     # Call summarize helper (llm_client.summarize_session)
     try:
-        result = summarize_session(session_id, conversation_text)
+        result = await run_blocking(summarize_session, session_id, conversation_text)
+    except (AdmissionRejected, UpstreamUnavailable):
+        raise
     except Exception as e:
         logger.exception("Summarize failed: %s", e)
         raise HTTPException(status_code=500, detail=f"summarize failed: {str(e)}")
 
     # result expected to be a dict like {"summary":"...","next_action":"..."}
     return result
+
+
+# ---------------------
+# Admin: request profiles
+# ---------------------
+def is_admin(token: Optional[str]) -> bool:
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8"))
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="admin endpoints are disabled (ADMIN_TOKEN not set)")
+    if not is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="admin token required")
+
+
+class ProfilingSettings(BaseModel):
+    sample_rate: Optional[float] = None
+    threshold_ms: Optional[float] = None
+    interval_ms: Optional[float] = None
+    capture_slow: Optional[bool] = None
+
+
+@app.get("/admin/profiling", dependencies=[Depends(require_admin)])
+async def get_profiling_settings():
+    return profiling.settings
+
+
+@app.post("/admin/profiling", dependencies=[Depends(require_admin)])
+async def update_profiling_settings(req: ProfilingSettings):
+    """Turn sampling on/off at runtime, e.g. {"sample_rate": 5, "threshold_ms": 800}."""
+    # pydantic v1/v2: requirements allow either (.dict() is deprecated on v2)
+    dump = getattr(req, "model_dump", None) or req.dict
+    updates = dump(exclude_none=True)
+    if "sample_rate" in updates and not 0 <= updates["sample_rate"] <= 100:
+        raise HTTPException(status_code=400, detail="sample_rate must be a percentage (0-100)")
+    if "interval_ms" in updates and updates["interval_ms"] <= 0:
+        raise HTTPException(status_code=400, detail="interval_ms must be positive")
+    profiling.settings.update(updates)
+    return profiling.settings
+
+
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles(limit: int = 50):
+    """Most recent captured requests (metadata + stage timings, without stacks)."""
+    return profiling.store.list(limit)
+
+
+@app.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def get_profile(profile_id: str):
+    try:
+        return profiling.store.get(profile_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="profile not found")
+
+
+@app.get("/admin/profiles/{profile_id}/folded", dependencies=[Depends(require_admin)], response_class=PlainTextResponse)
+async def get_profile_folded(profile_id: str):
+    """Collapsed stacks for flamegraph.pl / speedscope."""
+    try:
+        record = profiling.store.get(profile_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="profile not found")
+    if not record.get("folded"):
+        raise HTTPException(status_code=404, detail="request was captured without stack samples")
+    return PlainTextResponse(record["folded"])
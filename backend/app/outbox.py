@@ -0,0 +1,431 @@
+# backend/app/outbox.py
+"""
+Delivery of escalations to a ticketing webhook.
+
+faq.record_turn writes an escalation_outbox row in the same transaction as the
+escalated reply. This dispatcher claims due rows in batches, adds the session summary
+and recent transcript, and POSTs them to ESCALATION_WEBHOOK_URL:
+
+    POST <url>
+    Idempotency-Key: <batch key>
+    {"escalations": [{"idempotency_key": "escalation-42", "session_id": ..., "rule": ...,
+                      "summary": ..., "next_action": ..., "transcript": [...], ...}]}
+
+Each item carries its own idempotency key (stable across retries) so the receiver can
+dedupe redeliveries. A claim is a lease: state updates only apply while the row is still
+leased to this dispatcher, so a batch re-claimed after its lease expired can't be
+overwritten by the slow original owner. Failures are retried with exponential backoff (honouring
+Retry-After) until OUTBOX_MAX_ATTEMPTS, then the row is marked failed.
+
+Runs as a background thread of the API when ESCALATION_WEBHOOK_URL is set, or standalone:
+
+    python -m app.outbox              # loop
+    python -m app.outbox --once       # one dispatch cycle
+    python -m app.outbox --stub 8099  # local stub receiver for testing
+"""
+import os
+import json
+import time
+import random
+import hashlib
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional
+
+import httpx
+from dotenv import load_dotenv
+
+from . import faq, admission
+
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(os.path.dirname(__file__)), ".env"))
+
+logger = logging.getLogger(__name__)
+
+ESCALATION_WEBHOOK_URL = os.getenv("ESCALATION_WEBHOOK_URL", "")
+ESCALATION_WEBHOOK_TOKEN = os.getenv("ESCALATION_WEBHOOK_TOKEN", "")
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "20"))
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "2"))  # batches in flight at once
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "2"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_RETRY_BASE_SECONDS = float(os.getenv("OUTBOX_RETRY_BASE_SECONDS", "5"))
+OUTBOX_RETRY_MAX_SECONDS = float(os.getenv("OUTBOX_RETRY_MAX_SECONDS", "900"))
+OUTBOX_TIMEOUT_SECONDS = float(os.getenv("OUTBOX_TIMEOUT_SECONDS", "10"))
+# a claimed batch not finished within this long (crashed worker) becomes claimable again
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "120"))
+# budget for building a batch's payloads (summaries included); leaves room for the POST
+OUTBOX_BUILD_SECONDS = float(
+    os.getenv("OUTBOX_BUILD_SECONDS", str(max(1.0, OUTBOX_LEASE_SECONDS - 2 * OUTBOX_TIMEOUT_SECONDS)))
+)
+OUTBOX_TRANSCRIPT_MESSAGES = int(os.getenv("OUTBOX_TRANSCRIPT_MESSAGES", "20"))
+# generate a summary for sessions the batch job hasn't summarized yet (off the request path)
+OUTBOX_SUMMARIZE = os.getenv("OUTBOX_SUMMARIZE", "true").lower() in ("1", "true", "yes")
+
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+# ---------------------
+# Claiming + state transitions
+# ---------------------
+def claim_batch(limit: int = OUTBOX_BATCH_SIZE) -> List[Dict[str, Any]]:
+    """
+    Atomically take up to `limit` due rows (pending, or delivering with an expired lease).
+    BEGIN IMMEDIATE serializes claimers across threads and processes.
+    """
+    now = time.time()
+    conn = faq.get_conn()
+    conn.isolation_level = None
+    try:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute(
+            """
+            SELECT id, idempotency_key, session_id, message_id, rule, attempts, created_at
+            FROM escalation_outbox
+            WHERE (status = 'pending' AND next_attempt_at <= ?)
+               OR (status = 'delivering' AND lease_until < ?)
+            ORDER BY id
+            LIMIT ?
+            """,
+            (now, now, limit),
+        )
+        rows = [dict(r) for r in cur.fetchall()]
+        if rows:
+            lease = now + OUTBOX_LEASE_SECONDS
+            cur.execute(
+                f"UPDATE escalation_outbox SET status = 'delivering', lease_until = ? WHERE id IN ({','.join('?' * len(rows))})",
+                [lease] + [r["id"] for r in rows],
+            )
+            for r in rows:
+                r["lease_until"] = lease
+        cur.execute("COMMIT")
+        return rows
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+# appended to every state update: only touch rows this dispatcher still holds the lease on
+_OWNED = "id = ? AND status = 'delivering' AND lease_until = ?"
+
+
+def _log_lost(rows: List[Dict[str, Any]], updated: int, action: str):
+    if updated < len(rows):
+        logger.warning("Lost the lease on %d of %d outbox rows; skipped %s", len(rows) - updated, len(rows), action)
+
+
+def _renew_lease(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Extend the lease of rows still held by us. Returns those rows."""
+    lease = time.time() + OUTBOX_LEASE_SECONDS
+    conn = faq.get_conn()
+    kept = []
+    for r in rows:
+        cur = conn.execute(f"UPDATE escalation_outbox SET lease_until = ? WHERE {_OWNED}", (lease, r["id"], r["lease_until"]))
+        if cur.rowcount:
+            r["lease_until"] = lease
+            kept.append(r)
+    conn.commit()
+    conn.close()
+    _log_lost(rows, len(kept), "delivery")
+    return kept
+
+
+def _mark_delivered(rows: List[Dict[str, Any]]):
+    conn = faq.get_conn()
+    updated = 0
+    for r in rows:
+        updated += conn.execute(
+            f"""
+            UPDATE escalation_outbox
+            SET status = 'delivered', delivered_at = CURRENT_TIMESTAMP, lease_until = NULL, last_error = NULL
+            WHERE {_OWNED}
+            """,
+            (r["id"], r["lease_until"]),
+        ).rowcount
+    conn.commit()
+    conn.close()
+    _log_lost(rows, updated, "marking delivered")
+
+
+def _backoff(attempts: int, retry_after: Optional[float] = None) -> float:
+    delay = min(OUTBOX_RETRY_MAX_SECONDS, OUTBOX_RETRY_BASE_SECONDS * (2 ** (attempts - 1)))
+    delay *= random.uniform(0.8, 1.2)
+    if retry_after:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def _mark_failed(rows: List[Dict[str, Any]], error: str, retryable: bool, retry_after: Optional[float] = None):
+    conn = faq.get_conn()
+    now = time.time()
+    updated = 0
+    for r in rows:
+        attempts = r["attempts"] + 1
+        if retryable and attempts < OUTBOX_MAX_ATTEMPTS:
+            cur = conn.execute(
+                f"""
+                UPDATE escalation_outbox
+                SET status = 'pending', attempts = ?, next_attempt_at = ?, lease_until = NULL, last_error = ?
+                WHERE {_OWNED}
+                """,
+                (attempts, now + _backoff(attempts, retry_after), error[:500], r["id"], r["lease_until"]),
+            )
+        else:
+            cur = conn.execute(
+                f"UPDATE escalation_outbox SET status = 'failed', attempts = ?, lease_until = NULL, last_error = ? WHERE {_OWNED}",
+                (attempts, error[:500], r["id"], r["lease_until"]),
+            )
+        updated += cur.rowcount
+    conn.commit()
+    conn.close()
+    _log_lost(rows, updated, "rescheduling")
+
+
+# ---------------------
+# Payload + delivery
+# ---------------------
+def _summary_for(session_id: str, transcript: List[Dict[str, Any]]) -> Dict[str, Any]:
+    stored = faq.get_summary(session_id)
+    last_id = transcript[-1]["id"] if transcript else None
+    if stored and (last_id is None or (stored.get("last_message_id") or 0) >= last_id):
+        return {"summary": stored["summary"], "next_action": stored["next_action"]}
+    left = admission.remaining()
+    if OUTBOX_SUMMARIZE and transcript and (left is None or left > 1.0):
+        from .llm_client import summarize_session
+
+        try:
+            text = "\n".join(f"{(m['role'] or '').upper()}: {m['content'] or ''}" for m in transcript)
+            result = summarize_session(session_id, text)
+            faq.save_summary(session_id, result.get("summary", ""), result.get("next_action"), last_id)
+            return result
+        except Exception as e:
+            logger.warning("Summary for escalated session %s unavailable: %s", session_id, e)
+    if stored:
+        return {"summary": stored["summary"], "next_action": stored["next_action"]}
+    return {"summary": None, "next_action": None}
+
+
+def build_payload(row: Dict[str, Any]) -> Dict[str, Any]:
+    transcript = faq.get_transcript(row["session_id"], up_to_id=row["message_id"], limit=OUTBOX_TRANSCRIPT_MESSAGES)
+    session = faq.get_session(row["session_id"]) or {}
+    return {
+        "idempotency_key": row["idempotency_key"],
+        "session_id": row["session_id"],
+        "user_id": session.get("user_id"),
+        "session_metadata": session.get("metadata", {}),
+        "message_id": row["message_id"],
+        "rule": row["rule"],
+        "escalated_at": row["created_at"],
+        **_summary_for(row["session_id"], transcript),
+        "transcript": [{"role": m["role"], "content": m["content"]} for m in transcript],
+    }
+
+
+def _retry_after(resp: httpx.Response) -> Optional[float]:
+    try:
+        return float(resp.headers.get("Retry-After", ""))
+    except ValueError:
+        return None
+
+
+def deliver_batch(rows: List[Dict[str, Any]], url: str = ESCALATION_WEBHOOK_URL, http: Optional[httpx.Client] = None) -> bool:
+    """
+    POST one batch. Returns True when delivered; otherwise rows are rescheduled or failed.
+    Payloads are built under a deadline shorter than the lease (summaries that don't fit
+    fall back to the stored one), then the lease is renewed for the POST itself.
+    """
+    token = admission.start_deadline(OUTBOX_BUILD_SECONDS)
+    try:
+        items = {r["id"]: build_payload(r) for r in rows}
+    except Exception as e:
+        logger.exception("Failed to build escalation payloads: %s", e)
+        _mark_failed(rows, f"payload: {e}", retryable=True)
+        return False
+    finally:
+        admission.end_deadline(token)
+
+    rows = _renew_lease(rows)
+    if not rows:
+        return False
+
+    keys = sorted(r["idempotency_key"] for r in rows)
+    headers = {"Idempotency-Key": hashlib.sha256("\n".join(keys).encode("utf-8")).hexdigest()}
+    if ESCALATION_WEBHOOK_TOKEN:
+        headers["Authorization"] = f"Bearer {ESCALATION_WEBHOOK_TOKEN}"
+
+    client = http or httpx.Client(timeout=OUTBOX_TIMEOUT_SECONDS)
+    try:
+        resp = client.post(url, json={"escalations": [items[r["id"]] for r in rows]}, headers=headers)
+    except httpx.HTTPError as e:
+        logger.warning("Escalation webhook unreachable (%d items): %s", len(rows), e)
+        _mark_failed(rows, f"transport: {e}", retryable=True)
+        return False
+    finally:
+        if http is None:
+            client.close()
+
+    if 200 <= resp.status_code < 300:
+        _mark_delivered(rows)
+        return True
+    retryable = resp.status_code in RETRYABLE_STATUS
+    logger.warning("Escalation webhook returned %d (%d items, retryable=%s)", resp.status_code, len(rows), retryable)
+    _mark_failed(rows, f"http {resp.status_code}: {resp.text[:200]}", retryable, _retry_after(resp))
+    return False
+
+
+def dispatch_once(url: str = ESCALATION_WEBHOOK_URL, batch_size: int = OUTBOX_BATCH_SIZE, concurrency: int = OUTBOX_CONCURRENCY) -> Dict[str, int]:
+    """Claim up to `concurrency` batches and deliver them in parallel."""
+    batches = []
+    for _ in range(concurrency):
+        rows = claim_batch(batch_size)
+        if not rows:
+            break
+        batches.append(rows)
+    if not batches:
+        return {"batches": 0, "delivered": 0, "undelivered": 0}
+
+    with httpx.Client(timeout=OUTBOX_TIMEOUT_SECONDS) as http, ThreadPoolExecutor(max_workers=len(batches)) as pool:
+        results = list(pool.map(lambda b: deliver_batch(b, url, http), batches))
+    delivered = sum(len(b) for b, ok in zip(batches, results) if ok)
+    total = sum(len(b) for b in batches)
+    return {"batches": len(batches), "delivered": delivered, "undelivered": total - delivered}
+
+
+def stats() -> Dict[str, int]:
+    conn = faq.get_conn()
+    rows = conn.execute("SELECT status, COUNT(*) AS n FROM escalation_outbox GROUP BY status").fetchall()
+    conn.close()
+    return {r["status"]: r["n"] for r in rows}
+
+
+# ---------------------
+# Background loop
+# ---------------------
+class Dispatcher:
+    def __init__(self, url: str = ESCALATION_WEBHOOK_URL, poll_seconds: float = OUTBOX_POLL_SECONDS):
+        self.url = url
+        self.poll_seconds = poll_seconds
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                result = dispatch_once(self.url)
+            except Exception as e:
+                logger.exception("Outbox dispatch failed: %s", e)
+                result = {"batches": 0}
+            # keep draining while there is a backlog; otherwise poll
+            if not result["batches"]:
+                self._stop.wait(self.poll_seconds)
+
+    def start(self) -> "Dispatcher":
+        self._thread = threading.Thread(target=self._run, name="escalation-outbox", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+
+# ---------------------
+# Local stub receiver (testing)
+# ---------------------
+class WebhookStub(ThreadingHTTPServer):
+    """
+    Minimal webhook receiver: logs batches, dedupes items by idempotency key and,
+    with fail_every=N, answers every Nth request with fail_status (503 + Retry-After by
+    default) to exercise retries. Every request is kept in `requests` for inspection.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port: int = 0, fail_every: int = 0, fail_status: int = 503, retry_after: str = "1",
+                 host: str = "127.0.0.1", verbose: bool = False):
+        self.fail_every = fail_every
+        self.fail_status = fail_status
+        self.retry_after = retry_after
+        self.verbose = verbose
+        self.seen = set()
+        self.requests = []  # (lower-cased headers, body) per POST, including rejected ones
+        self.lock = threading.Lock()
+        super().__init__((host, port), _WebhookHandler)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self) -> "WebhookStub":
+        threading.Thread(target=self.serve_forever, name="webhook-stub", daemon=True).start()
+        return self
+
+    def receive(self, headers: Dict[str, str], body: Dict[str, Any]):
+        """Returns (status, extra headers, response body) for one POST."""
+        with self.lock:
+            self.requests.append((headers, body))
+            if self.fail_every and len(self.requests) % self.fail_every == 0:
+                extra = {"Retry-After": self.retry_after} if self.fail_status in (429, 503) else {}
+                return self.fail_status, extra, {"error": "stub failure"}
+            items = body.get("escalations", [])
+            new = [i for i in items if i.get("idempotency_key") not in self.seen]
+            self.seen.update(i.get("idempotency_key") for i in items)
+        if self.verbose:
+            print(f"batch {headers.get('idempotency-key', '')[:12]}: {len(items)} items, {len(new)} new")
+            for i in new:
+                print(f"  {i['idempotency_key']} session={i['session_id']} rule={i['rule']} summary={i.get('summary')!r}")
+        return 200, {}, {"accepted": len(new), "duplicates": len(items) - len(new)}
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        status, extra, reply = self.server.receive({k.lower(): v for k, v in self.headers.items()}, body)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        for name, value in extra.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(json.dumps(reply).encode("utf-8"))
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deliver pending escalations to the ticketing webhook.")
+    parser.add_argument("--once", action="store_true", help="run a single dispatch cycle and exit")
+    parser.add_argument("--url", default=ESCALATION_WEBHOOK_URL)
+    parser.add_argument("--stub", type=int, metavar="PORT", help="run a local stub receiver instead")
+    parser.add_argument("--stub-fail-every", type=int, default=0, help="stub answers every Nth request with 503")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.stub:
+        server = WebhookStub(args.stub, args.stub_fail_every, verbose=True)
+        print(f"Stub escalation webhook on {server.url}")
+        server.serve_forever()
+        return
+    if not args.url:
+        raise SystemExit("Set ESCALATION_WEBHOOK_URL or pass --url")
+    if args.once:
+        print(json.dumps({**dispatch_once(args.url), "outbox": stats()}))
+        return
+    dispatcher = Dispatcher(args.url).start()
+    try:
+        while True:
+            time.sleep(60)
+            logger.info("outbox: %s", stats())
+    except KeyboardInterrupt:
+        dispatcher.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+# backend/app/profiling.py
+"""
+On-demand request profiling.
+
+A request is profiled when it carries `X-Profile: 1` together with a valid admin token,
+or is picked by the sample rate.
+While it runs, a background thread samples the Python stack of the thread handling it
+every PROFILE_INTERVAL_MS and counts collapsed stacks ("outer;inner;leaf N" lines,
+the input format of flamegraph.pl / speedscope). Requests slower than the threshold
+are written, with their per-stage timings, to a bounded directory browsable through
+the /admin/profiles endpoints.
+
+The sampler starts on the event-loop thread; work handed to a worker thread inside
+follow_thread() (main.run_blocking) is sampled on that thread instead. Async code still
+shares the loop thread, so its samples can include frames from other requests.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import threading
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional
+from dotenv import load_dotenv
+
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(os.path.dirname(__file__)), ".env"))
+
+PROFILE_HEADER = "x-profile"
+
+# Runtime-adjustable through POST /admin/profiling
+settings: Dict[str, Any] = {
+    "sample_rate": float(os.getenv("PROFILE_SAMPLE_RATE", "0")),  # percent of requests
+    "threshold_ms": float(os.getenv("PROFILE_THRESHOLD_MS", "1000")),
+    "interval_ms": float(os.getenv("PROFILE_INTERVAL_MS", "5")),
+    # keep stage timings of slow requests even when they weren't sampled
+    "capture_slow": os.getenv("PROFILE_CAPTURE_SLOW", "true").lower() in ("1", "true", "yes"),
+}
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+PROFILE_MAX_STORED = int(os.getenv("PROFILE_MAX_STORED", "200"))
+
+
+# ---------------------
+# Stage timings
+# ---------------------
+_stages: contextvars.ContextVar[Optional[Dict[str, Dict[str, float]]]] = contextvars.ContextVar("profile_stages", default=None)
+_sampler: contextvars.ContextVar[Optional["StackSampler"]] = contextvars.ContextVar("profile_sampler", default=None)
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block of the current request. No-op outside a request."""
+    timings = _stages.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        entry = timings.setdefault(name, {"ms": 0.0, "count": 0})
+        entry["ms"] += (time.perf_counter() - started) * 1000
+        entry["count"] += 1
+
+
+def start_stages():
+    return _stages.set({})
+
+
+def end_stages(token) -> Dict[str, Dict[str, float]]:
+    timings = _stages.get() or {}
+    _stages.reset(token)
+    return {k: {"ms": round(v["ms"], 2), "count": v["count"]} for k, v in timings.items()}
+
+
+# ---------------------
+# Sampler
+# ---------------------
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+class StackSampler:
+    """Samples one thread's stack at a fixed interval into collapsed-stack counts."""
+
+    def __init__(self, thread_id: int, interval_ms: float = 5.0):
+        self.thread_id = thread_id
+        self.interval = interval_ms / 1000.0
+        self.counts: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            self.counts[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self) -> "StackSampler":
+        self._thread.start()
+        _sampler.set(self)
+        return self
+
+    def stop(self) -> str:
+        self._stop.set()
+        self._thread.join()
+        return "\n".join(f"{stack} {n}" for stack, n in self.counts.most_common())
+
+
+@contextmanager
+def follow_thread():
+    """Point the current request's sampler (if any) at this thread while the block runs."""
+    sampler = _sampler.get()
+    if sampler is None:
+        yield
+        return
+    previous, sampler.thread_id = sampler.thread_id, threading.get_ident()
+    try:
+        yield
+    finally:
+        sampler.thread_id = previous
+
+
+def forced(headers) -> bool:
+    """The request asks to be profiled. Only honour it for admins (see main.profile_requests)."""
+    return headers.get(PROFILE_HEADER, "").lower() in ("1", "true", "yes")
+
+
+def should_profile(headers, allow_forced: bool = False) -> bool:
+    if allow_forced and forced(headers):
+        return True
+    rate = settings["sample_rate"]
+    return rate > 0 and random.random() * 100 < rate
+
+
+# ---------------------
+# Bounded store
+# ---------------------
+class ProfileStore:
+    """One JSON file per captured request; oldest files are deleted beyond max_items."""
+
+    def __init__(self, directory: str = PROFILE_DIR, max_items: int = PROFILE_MAX_STORED):
+        self.directory = directory
+        self.max_items = max_items
+        self._lock = threading.Lock()
+
+    def _path(self, profile_id: str) -> str:
+        # ids are uuid hex; refuse anything else so the id can't escape the directory
+        if not profile_id.isalnum():
+            raise KeyError(profile_id)
+        return os.path.join(self.directory, f"{profile_id}.json")
+
+    def save(self, record: Dict[str, Any]) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        record = {"id": uuid.uuid4().hex, **record}
+        with self._lock:
+            tmp = self._path(record["id"]) + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(record, f)
+            os.replace(tmp, self._path(record["id"]))
+            self._prune()
+        return record["id"]
+
+    def _files(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        paths = [os.path.join(self.directory, n) for n in os.listdir(self.directory) if n.endswith(".json")]
+        return sorted(paths, key=os.path.getmtime, reverse=True)
+
+    def _prune(self):
+        for path in self._files()[self.max_items:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def list(self, limit: int = 50) -> List[Dict[str, Any]]:
+        out = []
+        for path in self._files()[:limit]:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    record = json.load(f)
+            except (OSError, ValueError):
+                continue
+            record.pop("folded", None)
+            out.append(record)
+        return out
+
+    def get(self, profile_id: str) -> Dict[str, Any]:
+        path = self._path(profile_id)
+        if not os.path.exists(path):
+            raise KeyError(profile_id)
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+
+store = ProfileStore()
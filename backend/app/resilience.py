@@ -0,0 +1,289 @@
+# backend/app/resilience.py
+import os
+import time
+import random
+import logging
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, Any, Optional, TypeVar
+
+import openai
+from dotenv import load_dotenv
+
+from . import admission
+from .admission import AdmissionRejected
+
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(os.path.dirname(__file__)), ".env"))
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Per-attempt timeout cap; the actual timeout is min(this, time left in the request deadline)
+UPSTREAM_TIMEOUT_SECONDS = float(os.getenv("UPSTREAM_TIMEOUT_SECONDS", "15"))
+UPSTREAM_MAX_ATTEMPTS = int(os.getenv("UPSTREAM_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.25"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "2.0"))
+# Don't start an attempt with less than this much budget left
+MIN_ATTEMPT_SECONDS = float(os.getenv("MIN_ATTEMPT_SECONDS", "0.5"))
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+
+# Hedging: if an attempt is still running after the observed p95 latency, fire a
+# duplicate and take whichever answers first. Costs extra tokens, so off by default.
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+# Threads for hedged attempts (primary + duplicate each hold one). Sized for every
+# upstream slot to be hedged; when all are busy the attempt runs inline, unhedged.
+HEDGE_POOL_SIZE = int(
+    os.getenv("HEDGE_POOL_SIZE", str(2 * (admission.LLM_MAX_CONCURRENCY + admission.EMBED_MAX_CONCURRENCY)))
+)
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class UpstreamUnavailable(Exception):
+    """The provider can't serve this call right now (circuit open, retries or deadline exhausted)."""
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    pass
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, AdmissionRejected):
+        return False
+    if isinstance(exc, (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code in RETRYABLE_STATUS
+    return isinstance(exc, (TimeoutError, ConnectionError))
+
+
+# ---------------------
+# Circuit breaker
+# ---------------------
+class CircuitBreaker:
+    """
+    closed -> open after `failure_threshold` consecutive retryable failures.
+    open -> half_open after `reset_timeout`; one probe call is let through.
+    half_open -> closed on success, back to open on failure.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_timeout: float = BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.short_circuited = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    self.short_circuited += 1
+                    raise CircuitOpenError(f"{self.name} circuit open")
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if self.state == "half_open":
+                if self._probe_in_flight:
+                    self.short_circuited += 1
+                    raise CircuitOpenError(f"{self.name} circuit half-open, probe in flight")
+                self._probe_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.times_opened += 1
+                    logger.warning("%s circuit opened after %d failures", self.name, self.failures)
+                self.state = "open"
+                self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def release_probe(self):
+        # a non-retryable error says nothing about provider health; let the next call probe
+        with self._lock:
+            self._probe_in_flight = False
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "times_opened": self.times_opened,
+            "short_circuited": self.short_circuited,
+        }
+
+
+class LatencyWindow:
+    """Rolling window of successful call latencies (seconds)."""
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            if not self._samples:
+                return None
+            ordered = sorted(self._samples)
+        idx = min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))
+        return ordered[idx]
+
+    def __len__(self):
+        return len(self._samples)
+
+
+# ---------------------
+# Policy
+# ---------------------
+_hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_POOL_SIZE, thread_name_prefix="hedge")
+# one permit per pool thread: a submitted attempt always starts immediately, so the
+# p95 wait below measures the call itself, never time queued behind other hedges
+_hedge_slots = threading.BoundedSemaphore(HEDGE_POOL_SIZE)
+
+
+def _submit_hedged(fn: Callable[[float], T], timeout: float) -> Optional[Future]:
+    """Start fn(timeout) on a free hedge thread with the caller's context; None if none is free."""
+    if not _hedge_slots.acquire(blocking=False):
+        return None
+    ctx = contextvars.copy_context()
+
+    def run():
+        try:
+            return ctx.run(fn, timeout)
+        finally:
+            _hedge_slots.release()
+
+    return _hedge_pool.submit(run)
+
+
+class UpstreamPolicy:
+    """
+    Deadline-aware retries + circuit breaker (+ optional hedging) for one upstream.
+    `fn` receives the per-attempt timeout in seconds and must pass it to the client.
+    """
+
+    def __init__(self, name: str, hedge: bool = HEDGE_ENABLED):
+        self.name = name
+        self.breaker = CircuitBreaker(name)
+        self.latency = LatencyWindow()
+        self.hedge = hedge
+        self.calls = 0
+        self.retries = 0
+        self.hedges_fired = 0
+        self.hedges_won = 0
+        self.hedges_skipped = 0
+
+    def call(self, fn: Callable[[float], T], max_attempts: int = UPSTREAM_MAX_ATTEMPTS) -> T:
+        self.calls += 1
+        last_exc: Optional[BaseException] = None
+        for attempt in range(max_attempts):
+            left = admission.remaining()
+            if left is not None and left < MIN_ATTEMPT_SECONDS:
+                raise UpstreamUnavailable(f"{self.name}: request deadline exhausted") from last_exc
+            timeout = UPSTREAM_TIMEOUT_SECONDS if left is None else min(UPSTREAM_TIMEOUT_SECONDS, left)
+
+            self.breaker.before_call()
+            started = time.monotonic()
+            try:
+                result = self._attempt(fn, timeout)
+            except Exception as e:
+                if not is_retryable(e):
+                    self.breaker.release_probe()
+                    raise
+                self.breaker.record_failure()
+                last_exc = e
+                logger.warning("%s attempt %d/%d failed: %s", self.name, attempt + 1, max_attempts, e)
+                if attempt + 1 >= max_attempts:
+                    break
+                delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)) * random.uniform(0.5, 1.0)
+                left = admission.remaining()
+                if left is not None and left - delay < MIN_ATTEMPT_SECONDS:
+                    break
+                self.retries += 1
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            self.latency.add(time.monotonic() - started)
+            return result
+        raise UpstreamUnavailable(f"{self.name}: {last_exc}") from last_exc
+
+    def _attempt(self, fn: Callable[[float], T], timeout: float) -> T:
+        hedge_after = self.latency.percentile(95) if self.hedge and len(self.latency) >= HEDGE_MIN_SAMPLES else None
+        if hedge_after is None or hedge_after >= timeout:
+            return fn(timeout)
+
+        # run in worker threads with the caller's context so deadlines/limits still apply
+        primary = _submit_hedged(fn, timeout)
+        if primary is None:
+            # saturated: duplicating calls now would only add load
+            self.hedges_skipped += 1
+            return fn(timeout)
+        done, _ = wait([primary], timeout=hedge_after)
+        if done:
+            return primary.result()
+
+        secondary = _submit_hedged(fn, max(timeout - hedge_after, MIN_ATTEMPT_SECONDS))
+        if secondary is None:
+            self.hedges_skipped += 1
+            return primary.result()
+        self.hedges_fired += 1
+        pending = {primary, secondary}
+        first_exc: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError(f"{self.name}: hedged attempt timed out")
+            for fut in done:
+                exc = fut.exception()
+                if exc is None:
+                    if fut is secondary:
+                        self.hedges_won += 1
+                    return fut.result()
+                # the duplicate being shed by admission control is fine, keep waiting on the other
+                if first_exc is None and not (fut is secondary and isinstance(exc, AdmissionRejected)):
+                    first_exc = exc
+        raise first_exc or TimeoutError(f"{self.name}: hedged attempt failed")
+
+    def metrics(self) -> Dict[str, Any]:
+        p50 = self.latency.percentile(50)
+        p95 = self.latency.percentile(95)
+        return {
+            "breaker": self.breaker.metrics(),
+            "calls": self.calls,
+            "retries": self.retries,
+            "hedging": self.hedge,
+            "hedges_fired": self.hedges_fired,
+            "hedges_won": self.hedges_won,
+            "hedges_skipped": self.hedges_skipped,
+            "latency_p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "latency_p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        }
+
+
+chat_policy = UpstreamPolicy("chat")
+embed_policy = UpstreamPolicy("embeddings")
+
+
+def metrics() -> Dict[str, Any]:
+    return {"chat": chat_policy.metrics(), "embeddings": embed_policy.metrics()}
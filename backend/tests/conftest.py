@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+# app modules read their config at import time: point them at a throwaway DB and a
+# dummy key before anything imports them (no test talks to OpenAI)
+_tmp = tempfile.mkdtemp(prefix="ai-cs-bot-tests-")
+os.environ["DB_URL"] = f"sqlite:///{os.path.join(_tmp, 'test.db')}"
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+os.environ["CACHE_BACKEND"] = "memory"
+os.environ["PROFILE_DIR"] = os.path.join(_tmp, "profiles")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
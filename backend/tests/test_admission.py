@@ -0,0 +1,57 @@
+import time
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+
+from app import admission, faq, llm_client, main
+
+
+def _slow_completion(*args, **kwargs):
+    time.sleep(0.5)
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content="Here is how to do that."), finish_reason="stop")],
+        usage=SimpleNamespace(prompt_tokens=10, completion_tokens=5, total_tokens=15),
+    )
+
+
+def test_llm_queue_fills_and_sheds_with_retry_after(monkeypatch):
+    monkeypatch.setattr(llm_client.client.chat.completions, "create", _slow_completion)
+    monkeypatch.setattr(faq, "get_top_k_faqs", lambda *a, **kw: [])
+    monkeypatch.setattr(main, "summarize_session_with_usage", lambda *a, **kw: ({"summary": None}, {}))
+    monkeypatch.setattr(admission.llm_limiter, "max_concurrency", 1)
+    monkeypatch.setattr(admission.llm_limiter, "max_queue", 2)
+    monkeypatch.setattr(admission.llm_limiter, "peak_waiting", 0)
+    monkeypatch.setattr(admission.llm_limiter, "rejected_queue_full", 0)
+
+    async def send_all():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*[
+                client.post("/message", json={"session_id": f"queue-{i}", "user_message": f"how do I export report {i}?"})
+                for i in range(6)
+            ])
+
+    started = time.monotonic()
+    responses = asyncio.run(send_all())
+    elapsed = time.monotonic() - started
+
+    statuses = sorted(r.status_code for r in responses)
+    # one in flight + two queued are served; the rest are shed immediately
+    assert statuses == [200, 200, 200, 429, 429, 429]
+    assert all(r.headers.get("Retry-After") for r in responses if r.status_code == 429)
+    assert admission.llm_limiter.peak_waiting == 2
+    assert admission.llm_limiter.rejected_queue_full == 3
+    # the three accepted turns ran back to back in the limiter, not serialized by the event loop
+    assert elapsed < 2.5
+
+    # shed turns leave nothing behind, so the client's retry doesn't duplicate the question
+    conn = faq.get_conn()
+    rows = conn.execute(
+        "SELECT session_id, role FROM messages WHERE session_id LIKE 'queue-%' ORDER BY id"
+    ).fetchall()
+    conn.close()
+    answered = {r["session_id"] for r in rows if r["role"] == "assistant"}
+    assert len(answered) == 3
+    assert {r["session_id"] for r in rows} == answered
+    assert len(rows) == 6
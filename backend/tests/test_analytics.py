@@ -0,0 +1,122 @@
+import sqlite3
+
+import pytest
+
+from app import analytics, faq, main
+
+
+@pytest.fixture
+def cur():
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+    analytics.create_tables(cur)
+    yield cur
+    conn.close()
+
+
+def _hourly(cur, topic=""):
+    return dict(cur.execute("SELECT * FROM hourly_stats WHERE topic = ?", (topic,)).fetchone())
+
+
+def test_bump_hourly_accumulates_into_one_row(cur):
+    analytics.bump_hourly(cur, "billing", messages=1, faq_lookups=1, faq_hits=1, llm_calls=2, llm_latency_ms=120.5, tokens=30)
+    analytics.bump_hourly(cur, "billing", messages=1, escalations=1, faq_lookups=1, llm_latency_ms=None)
+    analytics.bump_hourly(cur, "shipping", messages=1)
+
+    row = _hourly(cur, "billing")
+    assert cur.execute("SELECT COUNT(*) FROM hourly_stats").fetchone()[0] == 2
+    assert {c: row[c] for c in analytics.ROLLUP_COUNTERS} == {
+        "messages": 2, "escalations": 1, "faq_lookups": 2, "faq_hits": 1,
+        "llm_calls": 2, "llm_latency_ms": 120.5, "tokens": 30,
+    }
+
+
+def test_bump_hourly_rejects_unknown_counters(cur):
+    with pytest.raises(ValueError):
+        analytics.bump_hourly(cur, "", replies=1)
+
+
+def _seed(cur):
+    # two hours x two topics, written directly so the hour is under the test's control
+    for offset, topic, messages, escalations in [(0, "a", 4, 1), (0, "b", 2, 0), (-1, "a", 6, 3), (-30, "a", 100, 100)]:
+        cur.execute(
+            "INSERT INTO hourly_stats (hour, topic, messages, escalations) "
+            "VALUES (strftime('%Y-%m-%dT%H:00', 'now', ?), ?, ?, ?)",
+            (f"{offset} hours", topic, messages, escalations),
+        )
+
+
+def test_read_stats_group_by_hour(cur):
+    _seed(cur)
+    rows = analytics.read_stats(cur, hours=24, group_by="hour")
+    assert [(r["messages"], r["escalations"]) for r in rows] == [(6, 3), (6, 1)]  # oldest first
+    assert set(rows[0]) >= {"hour", "escalation_rate", "faq_hit_rate", "avg_llm_latency_ms"}
+    assert "topic" not in rows[0]
+    assert rows[0]["escalation_rate"] == 0.5 and rows[0]["faq_hit_rate"] is None
+
+
+def test_read_stats_group_by_topic(cur):
+    _seed(cur)
+    rows = analytics.read_stats(cur, hours=24, group_by="topic")
+    assert [(r["topic"], r["messages"], r["escalations"]) for r in rows] == [("a", 10, 4), ("b", 2, 0)]
+    assert "hour" not in rows[0]
+
+
+def test_read_stats_group_by_hour_topic(cur):
+    _seed(cur)
+    rows = analytics.read_stats(cur, hours=24, group_by="hour_topic")
+    assert [(r["topic"], r["messages"]) for r in rows] == [("a", 6), ("a", 4), ("b", 2)]
+    assert analytics.read_stats(cur, hours=1, group_by="hour_topic", topic="a")[0]["messages"] == 4
+    with pytest.raises(ValueError):
+        analytics.read_stats(cur, group_by="day")
+
+
+def test_escalation_events_record_the_rule():
+    faq.save_message("analytics-rule", "user", "I want a refund")
+    keyword_id = faq.record_turn("analytics-rule", "handing over", escalated=True, escalation_rule="keyword:refund", topic="billing")
+    faq.save_message("analytics-rule", "user", "still broken")
+    model_id = faq.record_turn("analytics-rule", "handing over", escalated=True)
+    faq.record_turn("analytics-rule", "all good")
+
+    conn = faq.get_conn()
+    rows = conn.execute(
+        "SELECT message_id, rule, topic FROM escalation_events WHERE session_id = 'analytics-rule' ORDER BY id"
+    ).fetchall()
+    conn.close()
+    assert [tuple(r) for r in rows] == [(keyword_id, "keyword:refund", "billing"), (model_id, "model", "")]
+
+
+def test_record_turn_round_trips_through_get_stats():
+    faq.save_message("analytics-rt", "user", "how do I pay?")
+    faq.record_turn("analytics-rt", "like this", topic="round-trip", faq_hit=True, llm_calls=1, llm_latency_ms=100.0, tokens=40)
+    faq.save_message("analytics-rt", "user", "refund please")
+    faq.record_turn("analytics-rt", "escalating", escalated=True, topic="round-trip", llm_calls=2, llm_latency_ms=300.0, tokens=60)
+    faq.record_llm_usage("round-trip", llm_calls=1, llm_latency_ms=50.0, tokens=10)
+
+    # two hours of window so a turn straddling the hour boundary still counts
+    [row] = faq.get_stats(hours=2, group_by="topic", topic="round-trip")
+    assert (row["messages"], row["escalations"], row["faq_lookups"], row["faq_hits"]) == (2, 1, 2, 1)
+    assert (row["llm_calls"], row["tokens"], row["llm_latency_ms"]) == (4, 110, 450.0)
+    assert row["escalation_rate"] == 0.5
+    assert row["faq_hit_rate"] == 0.5
+    assert row["avg_llm_latency_ms"] == 112.5
+
+
+def test_turn_summary_usage_reaches_the_rollup(monkeypatch):
+    monkeypatch.setattr(faq, "get_top_k_faqs", lambda *a, **kw: [])
+    monkeypatch.setattr(main, "generate_response", lambda **kw: {
+        "reply": "Here you go.", "escalation": False, "llm_calls": 1, "llm_latency_ms": 200.0, "tokens": 25,
+    })
+    monkeypatch.setattr(main, "summarize_session_with_usage", lambda sid, text: (
+        {"summary": "asked about invoices", "next_action": None},
+        {"llm_calls": 1, "llm_latency_ms": 80.0, "tokens": 12},
+    ))
+
+    session = {"user_id": None, "metadata": {"topic": "summary-usage"}}
+    response = main._run_turn("analytics-summary", "where is my invoice?", session)
+    assert response.summary == "asked about invoices"
+
+    [row] = faq.get_stats(hours=2, group_by="topic", topic="summary-usage")
+    assert row["messages"] == 1
+    assert (row["llm_calls"], row["llm_latency_ms"], row["tokens"]) == (2, 280.0, 37)
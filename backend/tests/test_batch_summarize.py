@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+from app import batch_summarize as bs
+from app import faq
+from app.resilience import UpstreamUnavailable
+
+
+@pytest.fixture
+def sessions(monkeypatch):
+    """Six finished sessions whose transcripts grow in length, so packs run in order."""
+    candidates = []
+    for i in range(6):
+        sid = f"batch-{i}"
+        faq.save_message(sid, "user", "question " + "x" * (10 * i))
+        last_id = faq.save_message(sid, "assistant", "answer")
+        candidates.append({"session_id": sid, "last_message_id": last_id, "message_count": 2})
+    monkeypatch.setattr(faq, "find_sessions_to_summarize", lambda **kw: list(candidates))
+    # force the per-session path so a pack can stop half-way through
+    monkeypatch.setattr(bs, "summarize_sessions_batch", lambda conversations: {})
+    return [c["session_id"] for c in candidates]
+
+
+def _summaries(session_ids):
+    return {sid for sid in session_ids if faq.get_summary(sid)}
+
+
+def test_resume_only_summarizes_pending_sessions(sessions, monkeypatch, tmp_path):
+    checkpoint = str(tmp_path / "checkpoint.json")
+    calls = []
+
+    def flaky(session_id, text):
+        calls.append(session_id)
+        if len(calls) >= 4:
+            raise UpstreamUnavailable("chat circuit open")
+        return {"summary": f"summary of {session_id}", "next_action": None}
+
+    monkeypatch.setattr(bs, "summarize_session", flaky)
+    report = bs.run(concurrency=1, pack_max=2, checkpoint_path=checkpoint)
+
+    # pack 1 (batch-0, batch-1) finished; pack 2 saved batch-2 before the provider went away
+    assert _summaries(sessions) == {"batch-0", "batch-1", "batch-2"}
+    assert report["summarized"] == 3 and report["remaining"] == 3
+    with open(checkpoint, encoding="utf-8") as f:
+        state = json.load(f)
+    assert sorted(state["done"]) == ["batch-0", "batch-1", "batch-2"]
+    assert state["failed"] == {}
+
+    def no_rescan(**kwargs):
+        raise AssertionError("a resumed run must reuse the checkpointed snapshot")
+
+    resumed = []
+    monkeypatch.setattr(faq, "find_sessions_to_summarize", no_rescan)
+    monkeypatch.setattr(bs, "summarize_session", lambda sid, text: resumed.append(sid) or {"summary": "ok"})
+    report = bs.run(concurrency=1, pack_max=2, checkpoint_path=checkpoint)
+
+    assert sorted(resumed) == ["batch-3", "batch-4", "batch-5"]
+    assert _summaries(sessions) == set(sessions)
+    assert (report["sessions"], report["summarized"], report["failed"], report["remaining"]) == (6, 6, 0, 0)
+    assert not (tmp_path / "checkpoint.json").exists()
+
+
+def test_fresh_ignores_an_existing_checkpoint(sessions, monkeypatch, tmp_path):
+    checkpoint = tmp_path / "checkpoint.json"
+    checkpoint.write_text(json.dumps({"candidates": [], "done": [], "failed": {}, "elapsed_seconds": 0.0}))
+    monkeypatch.setattr(bs, "summarize_session", lambda sid, text: {"summary": "ok"})
+
+    assert bs.run(checkpoint_path=str(checkpoint))["sessions"] == 0
+    assert bs.run(checkpoint_path=str(checkpoint), fresh=True)["summarized"] == 6
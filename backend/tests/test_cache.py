@@ -0,0 +1,62 @@
+import time
+
+import pytest
+
+from app.cache import LRUCache, RedisCache, RespStub
+
+
+@pytest.fixture
+def stub():
+    server = RespStub().start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_get_set_del(stub):
+    cache = RedisCache(stub.url)
+    assert cache.get("missing") is None
+    cache.set("k", {"a": 1})
+    assert cache.get("k") == {"a": 1}
+    cache.set("vec", [0.5, 0.25])
+    assert cache.get("vec") == [0.5, 0.25]
+    cache.invalidate("k")
+    assert cache.get("k") is None
+    assert stub.commands.count("SET") == 2 and "DEL" in stub.commands
+
+
+def test_set_px_expires(stub):
+    cache = RedisCache(stub.url)
+    cache.set("short", "x", ttl=0.05)
+    assert cache.get("short") == "x"
+    time.sleep(0.1)
+    assert cache.get("short") is None
+
+
+def test_reconnects_after_dropped_connection(stub):
+    cache = RedisCache(stub.url)
+    cache.set("k", "before")
+    stub.drop_connections()
+    assert cache.get("k") == "before"
+
+
+def test_unreachable_server_is_a_cache_miss():
+    server = RespStub()
+    url = server.url
+    server.server_close()
+    cache = RedisCache(url, timeout=0.1)
+    cache.set("k", "v")
+    assert cache.get("k") is None
+
+
+def test_generic_values_round_trip_exactly():
+    cache = LRUCache()
+    cache.set("floats", [0.1, 0.2])
+    assert cache.get("floats") == [0.1, 0.2]
+
+
+def test_vectors_are_stored_as_float32():
+    cache = LRUCache()
+    cache.set_vector("vec", [0.1] * 8)
+    assert len(cache.get_raw("vec")) == 1 + 8 * 4
+    assert cache.get_vector("vec") == pytest.approx([0.1] * 8, rel=1e-6)
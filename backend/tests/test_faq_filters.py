@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from app import faq
+from app.faq_index import FaqIndex
+
+METADATA = [
+    {"tenant": "acme", "product": "billing", "locale": "en"},
+    {"tenant": "acme", "product": ["billing", "payments"], "locale": "de"},
+    {"tenant": "globex", "product": "payments", "locale": "en"},
+    {"tenant": "globex", "product": ["shipping"], "locale": None},
+    {"tenant": "acme", "product": "shipping"},
+    {},
+]
+IDS = [101, 102, 103, 104, 105, 106]
+
+
+@pytest.fixture(params=["exact", "truncate", "int8"])
+def index(request):
+    vectors = np.random.default_rng(7).normal(size=(len(IDS), 16)).astype(np.float32)
+    return FaqIndex(request.param, dims=8).build(IDS, vectors, METADATA)
+
+
+def _index_ids(index, filters):
+    return sorted(int(index.ids[p]) for p in index.rows_for(filters))
+
+
+def _keyword_ids(filters):
+    return sorted(i for i, meta in zip(IDS, METADATA) if faq._matches(meta, filters))
+
+
+@pytest.mark.parametrize(
+    "filters, expected",
+    [
+        ({"tenant": "acme"}, [101, 102, 105]),
+        # AND across keys
+        ({"tenant": "acme", "product": "billing"}, [101, 102]),
+        ({"tenant": "acme", "locale": "en"}, [101]),
+        # OR within a list value
+        ({"product": ["billing", "shipping"]}, [101, 102, 104, 105]),
+        ({"tenant": "globex", "product": ["payments", "shipping"]}, [103, 104]),
+        # list-valued metadata lands in every listed partition
+        ({"product": "payments"}, [102, 103]),
+        # unknown keys or values match nothing
+        ({"region": "eu"}, []),
+        ({"tenant": "initech"}, []),
+        ({"tenant": "acme", "product": "unknown"}, []),
+        # missing / None metadata never matches
+        ({"locale": "None"}, []),
+        ({}, IDS),
+    ],
+)
+def test_index_and_keyword_filters_agree(index, filters, expected):
+    assert _index_ids(index, filters) == expected
+    assert _keyword_ids(filters) == expected
+
+
+def test_filtered_search_only_returns_matching_rows(index):
+    query = np.ones(16, dtype=np.float32)
+    hits = index.search(query, top_k=10, threshold=-1.0, filters={"tenant": "acme", "product": ["payments", "shipping"]})
+    assert sorted(faq_id for faq_id, _ in hits) == [102, 105]
+    assert index.search(query, top_k=10, filters={"tenant": "nobody"}) == []
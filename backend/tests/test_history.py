@@ -0,0 +1,63 @@
+from app import faq
+from app.cache import LRUCache
+
+
+class CountingCache(LRUCache):
+    def __init__(self):
+        super().__init__()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = super().get(key)
+        if key.split(":")[1] == "history":
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+
+def _from_db(session_id, limit):
+    conn = faq.get_conn()
+    rows = conn.execute(
+        "SELECT role, content FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?", (session_id, limit)
+    ).fetchall()
+    conn.close()
+    return [(r["role"], r["content"]) for r in reversed(rows)]
+
+
+def test_history_window_hits_on_following_turns(monkeypatch):
+    cache = CountingCache()
+    monkeypatch.setattr(faq, "cache", cache)
+    session_id = "history-hits"
+
+    read_hits = []
+    for turn in range(5):
+        # same order as main._run_turn: save the user message, then read the history
+        faq.save_message(session_id, "user", f"question {turn}")
+        hits = cache.hits
+        recent = faq.get_recent_messages(session_id, limit=4)
+        read_hits.append(cache.hits > hits)
+        assert [(m["role"], m["content"]) for m in recent] == _from_db(session_id, 4)
+        faq.record_turn(session_id, f"answer {turn}")
+
+    # the first turn fills the window; every later turn is served from it
+    assert read_hits == [False, True, True, True, True]
+    assert [(m["role"], m["content"]) for m in faq.get_recent_messages(session_id, 20)] == _from_db(session_id, 20)
+
+
+def test_window_dropped_when_another_writer_got_in_between(monkeypatch):
+    monkeypatch.setattr(faq, "cache", CountingCache())
+    session_id = "history-gap"
+    faq.save_message(session_id, "user", "one")
+    faq.get_recent_messages(session_id, limit=10)
+
+    # a write the cache never saw (e.g. cache set failed in another worker)
+    conn = faq.get_conn()
+    conn.execute("INSERT INTO messages (session_id, role, content) VALUES (?, 'user', 'two')", (session_id,))
+    conn.commit()
+    conn.close()
+
+    faq.save_message(session_id, "user", "three")
+    assert [m["content"] for m in faq.get_recent_messages(session_id, limit=10)] == ["one", "two", "three"]
@@ -0,0 +1,150 @@
+import time
+
+import pytest
+
+from app import faq, outbox
+
+
+def _escalate(session_id: str) -> int:
+    faq.save_message(session_id, "user", "I want a refund")
+    return faq.record_turn(session_id, "escalated", escalated=True, escalation_rule="keyword:refund")
+
+
+def _status(message_id: int) -> str:
+    conn = faq.get_conn()
+    row = conn.execute("SELECT status FROM escalation_outbox WHERE message_id = ?", (message_id,)).fetchone()
+    conn.close()
+    return row["status"]
+
+
+def _expire_leases():
+    conn = faq.get_conn()
+    conn.execute("UPDATE escalation_outbox SET lease_until = 0 WHERE status = 'delivering'")
+    conn.commit()
+    conn.close()
+
+
+def test_stale_owner_cannot_overwrite_reclaimed_rows():
+    message_id = _escalate("outbox-lease")
+    first = [r for r in outbox.claim_batch(100) if r["message_id"] == message_id]
+    _expire_leases()
+    second = [r for r in outbox.claim_batch(100) if r["message_id"] == message_id]
+    assert first and second
+
+    outbox._mark_delivered(second)
+    # the first dispatcher finishes late: its failure must not send the row back to pending
+    outbox._mark_failed(first, "slow summary", retryable=True)
+    assert _status(message_id) == "delivered"
+
+
+def test_lost_rows_are_not_posted(monkeypatch):
+    message_id = _escalate("outbox-renew")
+    rows = [r for r in outbox.claim_batch(100) if r["message_id"] == message_id]
+    _expire_leases()
+    outbox.claim_batch(100)  # another dispatcher takes them over
+
+    monkeypatch.setattr(outbox, "build_payload", lambda r: {"idempotency_key": r["idempotency_key"]})
+
+    class NoPost:
+        def post(self, *args, **kwargs):
+            raise AssertionError("posted rows whose lease was lost")
+
+    assert outbox.deliver_batch(rows, "http://unused", http=NoPost()) is False
+    assert _status(message_id) == "delivering"
+
+
+def _row(message_id: int):
+    conn = faq.get_conn()
+    row = conn.execute("SELECT * FROM escalation_outbox WHERE message_id = ?", (message_id,)).fetchone()
+    conn.close()
+    return dict(row)
+
+
+def _claim(message_id: int):
+    return [r for r in outbox.claim_batch(100) if r["message_id"] == message_id]
+
+
+def _make_due(message_id: int):
+    conn = faq.get_conn()
+    conn.execute("UPDATE escalation_outbox SET next_attempt_at = 0 WHERE message_id = ?", (message_id,))
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def webhook(monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_SUMMARIZE", False)
+    server = outbox.WebhookStub().start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_delivers_batch_to_webhook(webhook):
+    message_id = _escalate("outbox-post")
+    assert outbox.deliver_batch(_claim(message_id), webhook.url) is True
+
+    headers, body = webhook.requests[-1]
+    [item] = body["escalations"]
+    assert item["session_id"] == "outbox-post"
+    assert item["rule"] == "keyword:refund"
+    assert [m["role"] for m in item["transcript"]] == ["user", "assistant"]
+    assert headers["content-type"] == "application/json"
+    assert len(headers["idempotency-key"]) == 64
+    assert _status(message_id) == "delivered"
+
+
+def test_503_is_retried_after_retry_after(webhook):
+    webhook.fail_every, webhook.retry_after = 1, "30"
+    message_id = _escalate("outbox-503")
+    before = time.time()
+    assert outbox.deliver_batch(_claim(message_id), webhook.url) is False
+
+    row = _row(message_id)
+    assert row["status"] == "pending" and row["attempts"] == 1
+    assert row["lease_until"] is None
+    assert row["next_attempt_at"] >= before + 30  # Retry-After beats the 5s base backoff
+    assert row["last_error"].startswith("http 503")
+
+
+def test_backoff_grows_exponentially_and_gives_up(webhook, monkeypatch):
+    monkeypatch.setattr(outbox.random, "uniform", lambda a, b: 1.0)
+    assert [outbox._backoff(n) for n in (1, 2, 3)] == [
+        outbox.OUTBOX_RETRY_BASE_SECONDS * f for f in (1, 2, 4)
+    ]
+    assert outbox._backoff(50) == outbox.OUTBOX_RETRY_MAX_SECONDS
+
+    monkeypatch.setattr(outbox, "OUTBOX_MAX_ATTEMPTS", 2)
+    webhook.fail_every = 1
+    message_id = _escalate("outbox-exhausted")
+    for _ in range(2):
+        _make_due(message_id)
+        outbox.deliver_batch(_claim(message_id), webhook.url)
+    row = _row(message_id)
+    assert row["status"] == "failed" and row["attempts"] == 2
+
+
+@pytest.mark.parametrize("status", [400, 401, 422])
+def test_other_client_errors_fail_permanently(webhook, status):
+    webhook.fail_every, webhook.fail_status = 1, status
+    message_id = _escalate(f"outbox-{status}")
+    assert outbox.deliver_batch(_claim(message_id), webhook.url) is False
+
+    row = _row(message_id)
+    assert row["status"] == "failed" and row["attempts"] == 1
+    assert row["last_error"].startswith(f"http {status}")
+
+
+def test_idempotency_keys_are_stable_across_redeliveries(webhook):
+    webhook.fail_every = 1
+    message_id = _escalate("outbox-redeliver")
+    outbox.deliver_batch(_claim(message_id), webhook.url)
+
+    webhook.fail_every = 0
+    _make_due(message_id)
+    assert outbox.deliver_batch(_claim(message_id), webhook.url) is True
+
+    (first_headers, first), (second_headers, second) = webhook.requests
+    assert first["escalations"][0]["idempotency_key"] == second["escalations"][0]["idempotency_key"]
+    assert first["escalations"][0]["idempotency_key"] == _row(message_id)["idempotency_key"]
+    assert first_headers["idempotency-key"] == second_headers["idempotency-key"]
@@ -0,0 +1,42 @@
+from fastapi.testclient import TestClient
+
+from app import main, profiling
+
+client = TestClient(main.app)
+
+
+def test_admin_endpoints_disabled_without_token(monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", None)
+    assert client.get("/admin/profiling").status_code == 403
+    assert client.post("/admin/profiling", json={"sample_rate": 100}).status_code == 403
+    assert profiling.settings["sample_rate"] == 0
+
+
+def test_admin_endpoints_require_matching_token(monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "s3cret")
+    assert client.get("/admin/profiles", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert client.get("/admin/profiles", headers={"X-Admin-Token": "s3cret"}).status_code == 200
+
+
+def test_profile_header_needs_admin_token(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "s3cret")
+    monkeypatch.setattr(profiling, "store", profiling.ProfileStore(str(tmp_path)))
+
+    client.get("/health", headers={"X-Profile": "1"})
+    client.get("/health", headers={"X-Profile": "1", "X-Admin-Token": "wrong"})
+    assert profiling.store.list() == []
+
+    client.get("/health", headers={"X-Profile": "1", "X-Admin-Token": "s3cret"})
+    assert len(profiling.store.list()) == 1
+
+
+def test_profiling_settings_update_only_given_fields(monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "s3cret")
+    monkeypatch.setattr(profiling, "settings", dict(profiling.settings))
+    headers = {"X-Admin-Token": "s3cret"}
+    before = dict(profiling.settings)
+
+    resp = client.post("/admin/profiling", json={"sample_rate": 5, "threshold_ms": 800}, headers=headers)
+    assert resp.status_code == 200
+    assert resp.json() == {**before, "sample_rate": 5, "threshold_ms": 800}
+    assert client.post("/admin/profiling", json={"sample_rate": 150}, headers=headers).status_code == 400
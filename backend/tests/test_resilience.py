@@ -0,0 +1,207 @@
+import threading
+import time
+
+import httpx
+import openai
+import pytest
+
+from app import admission, faq, llm_client, resilience
+from app.resilience import CircuitBreaker, CircuitOpenError, UpstreamPolicy, UpstreamUnavailable, is_retryable
+
+_request = httpx.Request("POST", "https://api.openai.test/v1/chat/completions")
+
+
+def _status_error(cls, status):
+    return cls(f"status {status}", response=httpx.Response(status, request=_request), body=None)
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(resilience, "RETRY_BASE_DELAY", 0.001)
+    monkeypatch.setattr(resilience, "RETRY_MAX_DELAY", 0.005)
+
+
+def _policy(threshold=100, reset=30.0, hedge=False):
+    policy = UpstreamPolicy("test", hedge=hedge)
+    policy.breaker = CircuitBreaker("test", failure_threshold=threshold, reset_timeout=reset)
+    return policy
+
+
+def _failing(*errors, result="ok"):
+    """fn that raises `errors` in order, then returns `result`; records the timeouts it got."""
+    calls = []
+
+    def fn(timeout):
+        calls.append(timeout)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+
+    return fn, calls
+
+
+@pytest.mark.parametrize(
+    "exc, retryable",
+    [
+        (_status_error(openai.RateLimitError, 429), True),
+        (_status_error(openai.InternalServerError, 500), True),
+        (_status_error(openai.InternalServerError, 503), True),
+        (openai.APIConnectionError(request=_request), True),
+        (openai.APITimeoutError(request=_request), True),
+        (_status_error(openai.BadRequestError, 400), False),
+        (_status_error(openai.AuthenticationError, 401), False),
+        (_status_error(openai.NotFoundError, 404), False),
+        (admission.AdmissionRejected("llm queue full"), False),
+        (ValueError("bad json"), False),
+    ],
+)
+def test_retry_classification(exc, retryable):
+    assert is_retryable(exc) is retryable
+
+
+def test_retries_transient_errors_then_succeeds():
+    fn, calls = _failing(_status_error(openai.RateLimitError, 429), openai.APIConnectionError(request=_request))
+    policy = _policy()
+    assert policy.call(fn, max_attempts=3) == "ok"
+    assert len(calls) == 3
+    assert policy.retries == 2
+
+
+def test_client_errors_are_not_retried():
+    fn, calls = _failing(_status_error(openai.BadRequestError, 400))
+    with pytest.raises(openai.BadRequestError):
+        _policy().call(fn, max_attempts=3)
+    assert len(calls) == 1
+
+
+def test_gives_up_after_max_attempts():
+    fn, calls = _failing(*[_status_error(openai.InternalServerError, 502)] * 5)
+    with pytest.raises(UpstreamUnavailable):
+        _policy().call(fn, max_attempts=3)
+    assert len(calls) == 3
+
+
+def test_breaker_opens_then_lets_one_probe_through():
+    policy = _policy(threshold=2, reset=0.05)
+    fn, calls = _failing(*[TimeoutError("slow")] * 2)
+    with pytest.raises(UpstreamUnavailable):
+        policy.call(fn, max_attempts=2)
+    assert policy.breaker.state == "open"
+
+    # open: fails fast without calling the provider
+    with pytest.raises(CircuitOpenError):
+        policy.call(fn)
+    assert len(calls) == 2
+
+    time.sleep(0.06)
+    probe_started, release = threading.Event(), threading.Event()
+
+    def slow_probe(timeout):
+        probe_started.set()
+        release.wait(1)
+        return "recovered"
+
+    results = []
+    probe = threading.Thread(target=lambda: results.append(policy.call(slow_probe)))
+    probe.start()
+    probe_started.wait(1)
+    assert policy.breaker.state == "half_open"
+    # only one probe while half-open
+    with pytest.raises(CircuitOpenError):
+        policy.call(lambda timeout: "second caller")
+    release.set()
+    probe.join()
+    assert results == ["recovered"]
+    assert policy.breaker.state == "closed"
+
+
+def test_failed_probe_reopens_breaker():
+    policy = _policy(threshold=1, reset=0.01)
+    with pytest.raises(UpstreamUnavailable):
+        policy.call(_failing(TimeoutError())[0], max_attempts=1)
+    time.sleep(0.02)
+    with pytest.raises(UpstreamUnavailable):
+        policy.call(_failing(TimeoutError())[0], max_attempts=1)
+    assert policy.breaker.state == "open"
+    assert policy.breaker.times_opened == 2
+
+
+def test_attempt_timeouts_and_backoff_are_capped_by_the_deadline(monkeypatch):
+    monkeypatch.setattr(resilience, "MIN_ATTEMPT_SECONDS", 0.05)
+
+    def always_slow(timeout):
+        calls.append(timeout)
+        time.sleep(min(timeout, 0.1))
+        raise TimeoutError("slow")
+
+    calls = []
+    token = admission.start_deadline(0.3)
+    try:
+        started = time.monotonic()
+        with pytest.raises(UpstreamUnavailable):
+            _policy().call(always_slow, max_attempts=10)
+        elapsed = time.monotonic() - started
+    finally:
+        admission.end_deadline(token)
+    assert calls[0] <= 0.3
+    assert all(later < earlier for earlier, later in zip(calls, calls[1:]))
+    assert elapsed < 0.4
+    assert len(calls) < 10
+
+
+def test_hedge_fires_after_p95_and_the_faster_copy_wins():
+    policy = _policy(hedge=True)
+    for _ in range(resilience.HEDGE_MIN_SAMPLES):
+        policy.latency.add(0.02)
+    attempts = []
+
+    def fn(timeout):
+        attempts.append(timeout)
+        time.sleep(0.5 if len(attempts) == 1 else 0.01)
+        return f"attempt {len(attempts)}"
+
+    assert policy.call(fn) == "attempt 2"
+    assert policy.hedges_fired == 1 and policy.hedges_won == 1
+
+
+def test_hedge_skipped_when_pool_is_busy(monkeypatch):
+    monkeypatch.setattr(resilience, "_hedge_slots", threading.BoundedSemaphore(1))
+    resilience._hedge_slots.acquire()  # every hedge thread is taken
+    policy = _policy(hedge=True)
+    for _ in range(resilience.HEDGE_MIN_SAMPLES):
+        policy.latency.add(0.001)
+    calls = []
+    assert policy.call(lambda timeout: calls.append(timeout) or "inline") == "inline"
+    assert len(calls) == 1
+    assert policy.hedges_skipped == 1 and policy.hedges_fired == 0
+
+
+def test_generate_response_falls_back_to_best_faq(monkeypatch):
+    def unavailable(*args, **kwargs):
+        raise UpstreamUnavailable("chat circuit open")
+
+    monkeypatch.setattr(llm_client.chat_policy, "call", unavailable)
+    result = llm_client.generate_response(
+        "how do I change my email address?",
+        faq_text="Q: How do I change my email?\nA: Settings > Account.\n\nQ: Other\nA: ...",
+    )
+    assert result["fallback"] is True
+    assert "Settings > Account." in result["reply"]
+    assert "Other" not in result["reply"]
+
+
+def test_faq_search_falls_back_to_keywords(monkeypatch):
+    def unavailable(texts):
+        raise UpstreamUnavailable("embeddings circuit open")
+
+    monkeypatch.setattr(faq, "embed_texts", unavailable)
+    conn = faq.get_conn()
+    conn.execute(
+        "INSERT INTO faqs (question, answer, embedding, metadata) VALUES (?, ?, '[0.0]', '{}')",
+        ("How do I reset my password?", "Use the Forgot password link on the sign-in page."),
+    )
+    conn.commit()
+    conn.close()
+
+    hits = faq.get_top_k_faqs("reset password", top_k=3)
+    assert hits and hits[0]["question"] == "How do I reset my password?"
@@ -0,0 +1,119 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app import llm_client
+from app.admission import AdmissionRejected
+from app.resilience import UpstreamUnavailable
+
+LONG = "please explain " + "x" * llm_client.ROUTER_LONG_MESSAGE_CHARS
+
+
+def _completion(text, finish_reason="stop"):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=text), finish_reason=finish_reason)],
+        usage=SimpleNamespace(prompt_tokens=100, completion_tokens=20, total_tokens=120),
+    )
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    """Fake chat.completions.create answering per model; `replies[model]` is a completion or an exception."""
+    fake = SimpleNamespace(models=[], replies={})
+
+    def create(*, model, **kwargs):
+        fake.models.append(model)
+        reply = fake.replies[model]
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    monkeypatch.setattr(llm_client.client.chat.completions, "create", create)
+    return fake
+
+
+@pytest.mark.parametrize(
+    "message, faq_top_score, depth, tier",
+    [
+        ("how do I export a report?", 0.92, 0, "fast"),  # confident FAQ match
+        ("how do I export a report?", None, 0, "fast"),  # one signal isn't enough
+        ("how do I export a report?", 0.3, llm_client.ROUTER_DEEP_CONVERSATION, "strong"),
+        (LONG, 0.5, 0, "strong"),
+        (LONG, 0.95, llm_client.ROUTER_DEEP_CONVERSATION, "strong"),
+        (LONG, 0.95, 0, "fast"),
+    ],
+)
+def test_route_model_picks_tier_from_signals(message, faq_top_score, depth, tier):
+    assert llm_client.route_model(message, faq_top_score, depth) == tier
+
+
+@pytest.mark.parametrize(
+    "text, finish_reason, escalate",
+    [
+        ("Go to Settings > Export and pick CSV.", "stop", False),
+        ("ok", "stop", True),
+        ("Go to Settings > Export and then", "length", True),
+        ("I’m not sure, maybe try the export page?", "stop", True),
+    ],
+)
+def test_needs_escalation(text, finish_reason, escalate):
+    assert llm_client._needs_escalation(text, finish_reason) is escalate
+
+
+def test_confident_fast_answer_is_used(provider):
+    provider.replies[llm_client.FAST_MODEL] = _completion("Go to Settings > Export and pick CSV.")
+    result = llm_client.generate_response("how do I export a csv?", faq_top_score=0.9, conversation_depth=0)
+    assert provider.models == [llm_client.FAST_MODEL]
+    assert result["model"] == llm_client.FAST_MODEL
+    assert (result["llm_calls"], result["tokens"]) == (1, 120)
+
+
+def test_weak_fast_answer_escalates_to_strong(provider):
+    before = llm_client.router_metrics()["tiers"]["strong"]["escalated_from_fast"]
+    provider.replies[llm_client.FAST_MODEL] = _completion("I don't know, sorry.")
+    provider.replies[llm_client.STRONG_MODEL] = _completion("Open Billing > Invoices and click Download.")
+
+    result = llm_client.generate_response("where do I download last month's pdf?", faq_top_score=0.9, conversation_depth=0)
+    assert provider.models == [llm_client.FAST_MODEL, llm_client.STRONG_MODEL]
+    assert result["reply"] == "Open Billing > Invoices and click Download."
+    assert result["model"] == llm_client.STRONG_MODEL
+    assert (result["llm_calls"], result["tokens"]) == (2, 240)
+    assert llm_client.router_metrics()["tiers"]["strong"]["escalated_from_fast"] == before + 1
+
+    # the validated strong answer is cached
+    again = llm_client.generate_response("where do I download last month's pdf?", faq_top_score=0.9, conversation_depth=0)
+    assert again["cached"] is True and len(provider.models) == 2
+
+
+def test_strong_route_skips_the_fast_tier(provider):
+    provider.replies[llm_client.STRONG_MODEL] = _completion("Here is a detailed walkthrough.")
+    result = llm_client.generate_response(LONG, faq_top_score=None, conversation_depth=0)
+    assert provider.models == [llm_client.STRONG_MODEL]
+    assert result["model"] == llm_client.STRONG_MODEL
+
+
+@pytest.mark.parametrize(
+    "strong_error",
+    [AdmissionRejected("llm queue full"), UpstreamUnavailable("chat circuit open")],
+    ids=["shed", "unavailable"],
+)
+def test_degraded_keeps_fast_answer_and_skips_cache(provider, strong_error):
+    message = f"can I rename a workspace? ({strong_error.__class__.__name__})"
+    provider.replies[llm_client.FAST_MODEL] = _completion("I'm not sure, but try Settings > Workspace.")
+    provider.replies[llm_client.STRONG_MODEL] = strong_error
+
+    result = llm_client.generate_response(message, faq_top_score=0.9, conversation_depth=0)
+    assert result["reply"] == "I'm not sure, but try Settings > Workspace."
+    assert result["model"] == llm_client.FAST_MODEL
+    assert "fallback" not in result and result["llm_calls"] == 1
+
+    # not cached: the next turn asks the provider again
+    again = llm_client.generate_response(message, faq_top_score=0.9, conversation_depth=0)
+    assert "cached" not in again
+    assert provider.models == [llm_client.FAST_MODEL, llm_client.STRONG_MODEL] * 2
+
+
+def test_shed_without_any_answer_propagates(provider):
+    provider.replies[llm_client.FAST_MODEL] = AdmissionRejected("llm queue full")
+    with pytest.raises(AdmissionRejected):
+        llm_client.generate_response("how do I invite a teammate?", faq_top_score=0.9, conversation_depth=0)